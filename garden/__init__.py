@@ -11,6 +11,43 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'garden.sqlite'),
+        GARDEN_DB_POOL_SIZE=8,
+        GARDEN_DB_CACHED_STATEMENTS=256,
+        GARDEN_DB_MMAP_SIZE=64 * 1024 * 1024,
+        GARDEN_DB_CACHE_SIZE=-16000,
+        GARDEN_DB_BUSY_TIMEOUT=5000,
+        GARDEN_AUTH_CACHE_TTL=60,
+        GARDEN_AUTH_CLAIM_TTL=300,
+        GARDEN_AUTH_REVOCATIONS=os.path.join(app.instance_path, 'revocations.json'),
+        GARDEN_AUTH_ATTEMPT_WINDOW=300,
+        GARDEN_LOGIN_ATTEMPTS=10,
+        GARDEN_REGISTER_ATTEMPTS=5,
+        GARDEN_HASH_CONCURRENCY=2,
+        GARDEN_HASH_WAIT=10,
+        GARDEN_CONCURRENT_IO=False,
+        GARDEN_BATCH_SENSOR_READS=True,
+        GARDEN_DEVICE_PATTERN='/dev/ttyACM*',
+        GARDEN_UUID_HEARTBEAT=30,
+        GARDEN_SERIAL_TIMEOUT=1.0,
+        GARDEN_TICK_PERIOD=1.0,
+        GARDEN_TICK_REPORT_EVERY=300,
+        GARDEN_SENSOR_READS_PER_TICK=0,
+        GARDEN_READING_STALENESS=120,
+        GARDEN_INCREMENTAL_RULES=True,
+        GARDEN_RELAY_CHANGE_ONLY=True,
+        GARDEN_RELAY_REASSERT_INTERVAL=30,
+        GARDEN_WRITE_BEHIND=True,
+        GARDEN_FLUSH_INTERVAL=0,
+        GARDEN_LIVE_SOCKET=os.path.join(app.instance_path, 'live.sock'),
+        GARDEN_LIVE_MIN_INTERVAL=1.0,
+        GARDEN_RPC_SOCKET=os.path.join(app.instance_path, 'control.sock'),
+        GARDEN_RPC_TIMEOUT=5,
+        GARDEN_METRICS_FILE=os.path.join(app.instance_path, 'metrics.prom'),
+        GARDEN_METRICS_INTERVAL=15,
+        GARDEN_STAGE_BUDGETS={
+            'readActiveSensors': 0.5,
+            'contactRelays': 0.3,
+        },
     )
 
     if test_config is None:
@@ -30,10 +67,22 @@ def create_app(test_config=None):
     db.init_app(app)
 
     from . import auth
-    app.register_blueprint(auth.bp)
+    auth.init_app(app)
    
     from . import manager
     manager.init_app(app)
 
+    from . import metrics
+    app.register_blueprint(metrics.bp)
+
+    from . import data
+    app.register_blueprint(data.bp)
+
+    from . import control
+    app.register_blueprint(control.bp)
+
+    from . import live
+    live.init_app(app)
+
     socketio.init_app(app)
     return app
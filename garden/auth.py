@@ -1,20 +1,164 @@
+import click
+import collections
 import functools
+import json
+import os
 import string
 import random
-import uuid
+import threading
 import time
 from garden.model import Client
 
 from flask import (
-    Blueprint, g, request, jsonify, session
+    Blueprint, current_app, g, request, jsonify, session
 )
+from flask.cli import with_appcontext
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from garden.db import get_db
+from garden import socketio
+from garden.db import get_db, get_read_db
+
+try:
+    from eventlet import tpool
+    from eventlet.semaphore import BoundedSemaphore as GreenSemaphore
+except ImportError:
+    tpool = None
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+_alphabet = string.ascii_uppercase + string.ascii_lowercase + string.digits
+
+class HashingBusy(Exception):
+    pass
+
+class AttemptLimiter(object):
+    """Sliding window of recent attempts per key, e.g. a login identifier"""
+
+    def __init__(self):
+        self.attempts = {}
+
+    def allow(self, key, limit, window):
+        current_time = time.monotonic()
+        horizon = current_time - window
+
+        if len(self.attempts) > 10000:
+            self.attempts = dict((other, attempts) for other, attempts in self.attempts.items() if attempts and attempts[-1] > horizon)
+
+        attempts = self.attempts.setdefault(key, collections.deque())
+        while attempts and attempts[0] <= horizon:
+            attempts.popleft()
+
+        if len(attempts) >= limit:
+            return False
+
+        attempts.append(current_time)
+        return True
+
+_login_attempts = AttemptLimiter()
+_register_attempts = AttemptLimiter()
+_hashing = {'slots': None}
+
+def green():
+    return tpool is not None and getattr(socketio, 'async_mode', None) == 'eventlet'
+
+def hash_slots():
+    if _hashing['slots'] is None:
+        size = current_app.config['GARDEN_HASH_CONCURRENCY']
+        _hashing['slots'] = GreenSemaphore(size) if green() else threading.BoundedSemaphore(size)
+
+    return _hashing['slots']
+
+def offload_hashing(function, *args):
+    """Hash outside the eventlet hub, a bounded number at a time, raising HashingBusy after GARDEN_HASH_WAIT"""
+    slots = hash_slots()
+
+    if not slots.acquire(timeout=current_app.config['GARDEN_HASH_WAIT']):
+        raise HashingBusy()
+
+    try:
+        if green():
+            return tpool.execute(function, *args)
+        return function(*args)
+    finally:
+        slots.release()
+
+_clients = {}
+_revocations = {'mtime': None, 'clients': {}}
+
+def fetch_client(client_uuid):
+    """Client row from the per-process cache, read through on a miss or expiry"""
+    current_time = time.time()
+    cached = _clients.get(client_uuid)
+
+    if cached is not None and cached[1] > current_time:
+        return cached[0]
+
+    client = get_read_db().execute(
+        'SELECT * FROM client WHERE uuid = ?', (client_uuid,)
+    ).fetchone()
+
+    _clients[client_uuid] = (client, current_time + current_app.config['GARDEN_AUTH_CACHE_TTL'])
+    return client
+
+def load_revocations():
+    """Reload the shared revocation file when another process has changed it"""
+    path = current_app.config['GARDEN_AUTH_REVOCATIONS']
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return _revocations['clients']
+
+    if mtime != _revocations['mtime']:
+        try:
+            with open(path) as f:
+                revoked = json.load(f)
+        except (OSError, ValueError):
+            return _revocations['clients']
+
+        _revocations['mtime'] = mtime
+        _revocations['clients'] = revoked
+
+        for client_uuid in revoked:
+            _clients.pop(client_uuid, None)
+
+    return _revocations['clients']
+
+def invalidate_client(client_uuid):
+    """Drop a client from every process's cache and void its signed claims"""
+    _clients.pop(client_uuid, None)
+
+    current_time = time.time()
+    horizon = current_time - current_app.config['GARDEN_AUTH_CLAIM_TTL']
+    path = current_app.config['GARDEN_AUTH_REVOCATIONS']
+
+    revoked = dict((key, value) for key, value in load_revocations().items() if value > horizon)
+    revoked[client_uuid] = current_time
+
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(revoked, f)
+    os.replace(temporary, path)
+
+    _revocations['clients'] = revoked
+
+def sign_claims(client):
+    """Store what later requests need to know about the client in the signed session"""
+    session['client_nickname'] = client['nickname']
+    session['client_active'] = bool(client['active'])
+    session['claims_issued'] = time.time()
+    session['claims_expire'] = time.time() + current_app.config['GARDEN_AUTH_CLAIM_TTL']
+
+def claimed_client(client_uuid):
+    return {'uuid': client_uuid, 'nickname': session.get('client_nickname'), 'active': session.get('client_active')}
+
+def claims_valid(client_uuid):
+    if not session.get('client_active') or session.get('claims_expire', 0) <= time.time():
+        return False
+
+    return session.get('claims_issued', 0) > load_revocations().get(client_uuid, 0)
+
 @bp.route('/register', methods=['POST'])
 def register():
     if request.method == 'POST':
@@ -25,12 +169,20 @@ def register():
         if not nickname:
             error = 'Nickname is required.'
 
+        if error is None and not _register_attempts.allow(request.remote_addr, current_app.config['GARDEN_REGISTER_ATTEMPTS'], current_app.config['GARDEN_AUTH_ATTEMPT_WINDOW']):
+            return jsonify(error='Too many registrations, try again later.'), 429
+
         if error is None:
 
-            identifier = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in range(255))
-            secret = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in range(255))
+            identifier = ''.join(random.SystemRandom().choices(_alphabet, k=255))
+            secret = ''.join(random.SystemRandom().choices(_alphabet, k=255))
 
-            client = Client({'identifier': identifier, 'secret': generate_password_hash(secret), 'active': 0, 'nickname': nickname})
+            try:
+                secret_hash = offload_hashing(generate_password_hash, secret)
+            except HashingBusy:
+                return jsonify(error='Server busy, try again.'), 503
+
+            client = Client({'identifier': identifier, 'secret': secret_hash, 'active': 0, 'nickname': nickname})
             client.save()
             client.refresh()
             client.save()
@@ -46,7 +198,11 @@ def login():
     if request.method == 'POST':
         identifier = request.form['identifier']
         secret = request.form['secret']
-        db = get_db()
+
+        if not _login_attempts.allow(identifier, current_app.config['GARDEN_LOGIN_ATTEMPTS'], current_app.config['GARDEN_AUTH_ATTEMPT_WINDOW']):
+            return jsonify({'authenticated': False, 'error': 'Too many attempts, try again later.'}), 429
+
+        db = get_read_db()
         error = None
         client = db.execute(
             'SELECT * FROM client WHERE identifier = ?', (identifier,)
@@ -54,20 +210,37 @@ def login():
 
         if client is None:
             error = 'Invalid client.'
-        elif not check_password_hash(client['secret'], secret):
-            error = 'Authentication failed.'
-        elif not client['active']:
-            error = 'Your account is not active.'
+        else:
+            try:
+                matches = offload_hashing(check_password_hash, client['secret'], secret)
+            except HashingBusy:
+                return jsonify({'authenticated': False, 'error': 'Server busy, try again.'}), 503
+
+            if not matches:
+                error = 'Authentication failed.'
+            elif not client['active']:
+                error = 'Your account is not active.'
 
         if error is None:
             session.clear()
             session['client_uuid'] = client['uuid']
             session['login_time'] = time.time()
             session['last_request_time'] = time.time()
+            sign_claims(client)
             return jsonify({'authenticated': True}), 200
 
         return jsonify({'authenticated': False, 'error': error}), 400
 
+def login_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if g.client is None:
+            return jsonify({'authenticated': False, 'error': 'Authentication required.'}), 401
+
+        return view(**kwargs)
+
+    return wrapped_view
+
 @bp.before_app_request
 def load_authenticated_client():
     client_uuid = session.get('client_uuid')
@@ -84,6 +257,59 @@ def load_authenticated_client():
             session.clear()
             return
 
-        g.client = get_db().execute(
-            'SELECT * FROM client WHERE uuid = ?', (client_uuid,)
-        ).fetchone()
+        if claims_valid(client_uuid):
+            g.client = claimed_client(client_uuid)
+            return
+
+        client = fetch_client(client_uuid)
+
+        if client is None or not client['active']:
+            g.client = None
+            session.clear()
+            return
+
+        sign_claims(client)
+        g.client = claimed_client(client_uuid)
+
+def set_client_active(reference, active):
+    rows = get_db().execute(
+        'SELECT * FROM client WHERE uuid = ? OR identifier = ? OR nickname = ?', (reference, reference, reference)
+    ).fetchall()
+
+    if len(rows) != 1:
+        return None
+
+    client = Client.fromRow(rows[0])
+    client.setAttribute('active', 1 if active else 0)
+    client.save()
+    invalidate_client(client.uuid)
+    return client
+
+@click.command('activate-client')
+@click.argument('reference')
+@with_appcontext
+def activate_client_command(reference):
+    """Allow a client, given by uuid, identifier or nickname, to log in."""
+    client = set_client_active(reference, True)
+
+    if client is None:
+        click.echo('No single client matches %s' % reference)
+    else:
+        click.echo('Activated %s' % client.nickname)
+
+@click.command('deactivate-client')
+@click.argument('reference')
+@with_appcontext
+def deactivate_client_command(reference):
+    """Revoke a client's access, including sessions already signed in."""
+    client = set_client_active(reference, False)
+
+    if client is None:
+        click.echo('No single client matches %s' % reference)
+    else:
+        click.echo('Deactivated %s' % client.nickname)
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.cli.add_command(activate_client_command)
+    app.cli.add_command(deactivate_client_command)
@@ -1,26 +1,102 @@
+import click
+import sqlite3
+from flask import g
 from garden.db import get_db
 import uuid
 
 def scrub(table_name):
     return ''.join(chr for chr in table_name if (chr.isalnum() or chr == "_"))
 
-class Model(object):
-    def __init__(self, *initial_data, **kwargs):
-        self._keys = {}
-        
-        for dictionary in initial_data:
-            for key in dictionary:
-                self.setAttribute(key, dictionary[key])
-        for key in kwargs:
-            self.setAttribute(key, kwargs[key])
-        
-        if not self.hasAttribute('uuid'):
-            self.setAttribute("uuid", str(uuid.uuid4()))
+def get_write_behind():
+    return g.get('write_behind')
 
-        self._persisted = False
-        self._clean = False
+def enable_write_behind():
+    if 'write_behind' not in g:
+        g.write_behind = WriteBehind()
 
-        self.afterInit()
+    return g.write_behind
+
+def execute_deferred(sql, params):
+    """Run a raw statement through the write-behind queue when one is active"""
+    queue = get_write_behind()
+
+    if queue is not None:
+        queue.pushStatement(sql, params)
+        return
+
+    db = get_db()
+    db.execute(sql, params)
+    db.commit()
+
+class WriteBehind(object):
+    """Queue saves and raw statements, writing them in one transaction grouped by SQL"""
+
+    def __init__(self):
+        self.pending = {}
+        self.statements = []
+
+    def push(self, model, insert):
+        key = (model._table, model.uuid)
+
+        if key not in self.pending:
+            self.pending[key] = (model, insert)
+
+    def pushStatement(self, sql, params):
+        self.statements.append((sql, params))
+
+    def count(self):
+        return len(self.pending) + len(self.statements)
+
+    def flush(self):
+        if not self.pending and not self.statements:
+            return 0
+
+        try:
+            statements = {}
+            for model, insert in self.pending.values():
+                sql, params = model.insertStatement() if insert else model.updateStatement()
+                if sql is not None:
+                    statements.setdefault(sql, []).append(params)
+
+            for sql, params in self.statements:
+                statements.setdefault(sql, []).append(params)
+
+            db = get_db()
+
+            try:
+                with db:
+                    for sql in statements:
+                        db.executemany(sql, statements[sql])
+            except sqlite3.Error as e:
+                click.echo("Batched write failed, retrying row by row: %s" % e)
+                self.retry(db, statements)
+
+            for model, insert in self.pending.values():
+                model.markClean()
+
+            return self.count()
+        finally:
+            # a row that cannot be written must not hold up every later flush
+            self.pending = {}
+            self.statements = []
+
+    def retry(self, db, statements):
+        """Write each row on its own, dropping the ones that still fail"""
+        for sql in statements:
+            for params in statements[sql]:
+                try:
+                    with db:
+                        db.execute(sql, params)
+                except sqlite3.Error as e:
+                    click.echo("Dropped write %r: %s" % (params, e))
+
+class Persistent(object):
+    """Persistence shared by dict-backed models and slotted records"""
+    __slots__ = ()
+
+    _write_behind = False
+    _observable = False
+    _statements = {}
 
     def afterInit(self):
         pass
@@ -28,18 +104,17 @@ class Model(object):
     def fromDB(self):
         self._persisted = True
         self._clean = True
+        self._dirty = None
 
         return self
 
-    """DB-based attributes"""
-    def setAttribute(self, key, value):
-        setattr(self, key, value)
-        if key not in self._keys:
-            self._keys[key] = True
+    def isDirty(self):
+        return bool(self._dirty)
 
-    """DB-based attributes"""
-    def hasAttribute(self, key):
-        return hasattr(self, key) and (key in self._keys)
+    def markDirty(self, key):
+        if self._dirty is None:
+            self._dirty = set()
+        self._dirty.add(key)
 
     """DB-based attributes"""
     def getAttribute(self, key):
@@ -67,49 +142,157 @@ class Model(object):
             self.setAttribute(key, row[key])
 
         self._clean = True
+        self._dirty = None
+
+    def applyRow(self, row):
+        """Update attributes from a freshly read row, returning the keys that changed"""
+        changed = set()
+
+        for key in row.keys():
+            if not self.hasAttribute(key) or getattr(self, key) != row[key]:
+                self.setAttribute(key, row[key])
+                changed.add(key)
+
+        if self._dirty:
+            self._dirty.difference_update(changed)
+        return changed
 
     def preSave(self):
         pass
 
-    def save(self):
+    def save(self, deferred=None):
+        """Write the record, through the write-behind queue if it defers by default or deferred is set"""
+        if self._persisted and not self._dirty:
+            return
+
         self.preSave()
 
-        dictionary = self.dictionary()
+        if deferred is None:
+            deferred = self._write_behind
 
-        db = get_db()
+        queue = get_write_behind() if deferred else None
 
-        if self._persisted:
-            params = []
-            for key in dictionary:
-                params.append(scrub(key) + '=:' + scrub(key))
+        if queue is not None:
+            queue.push(self, not self._persisted)
+            self._persisted = True
+            return
 
-            db.execute(
-                'UPDATE ' + scrub(self._table) + ' SET ' + ', '.join(params) + ' WHERE uuid=:uuid', dictionary
-            )
-            db.commit()
+        if self._persisted:
+            sql, params = self.updateStatement()
         else:
-            columns = []
-            params = []
-            for key in dictionary:
-                columns.append(scrub(key))
-                params.append(':' + scrub(key))
+            sql, params = self.insertStatement()
 
-            db.execute(
-                'INSERT INTO ' + scrub(self._table) + ' (' + ', '.join(columns) + ') VALUES (' + ', '.join(params) + ')', dictionary
-            )
+        if sql is not None:
+            db = get_db()
+            db.execute(sql, params)
             db.commit()
 
+        self.markClean()
+        return
+
+    @classmethod
+    def statement(cls, kind, columns):
+        """Build or fetch the cached SQL for a table and column set"""
+        key = (cls._table, kind, columns)
+
+        if key not in Persistent._statements:
+            if kind == 'insert':
+                sql = 'INSERT INTO ' + scrub(cls._table) + ' (' + ', '.join(scrub(column) for column in columns) + ') VALUES (' + ', '.join(':' + scrub(column) for column in columns) + ')'
+            else:
+                sql = 'UPDATE ' + scrub(cls._table) + ' SET ' + ', '.join(scrub(column) + '=:' + scrub(column) for column in columns) + ' WHERE uuid=:uuid'
+            Persistent._statements[key] = sql
+
+        return Persistent._statements[key]
+
+    def insertStatement(self):
+        dictionary = self.dictionary()
+
+        return self.statement('insert', tuple(dictionary)), dictionary
+
+    def updateStatement(self):
+        """Only the columns changed since load or the last write are set"""
+        dirty = self._dirty or ()
+        columns = tuple(key for key in self.attributeNames() if key in dirty and key != 'uuid')
+
+        if not columns:
+            return None, None
+
+        params = {'uuid': self.uuid}
+        for key in columns:
+            params[key] = getattr(self, key)
+
+        return self.statement('update', columns), params
+
+    def markClean(self):
         self._persisted = True
         self._clean = True
-        return
+        self._dirty = None
 
     def dictionary(self):
         dictionary = {}
 
-        for key in self._keys:
+        for key in self.attributeNames():
             dictionary[key] = getattr(self, key)
         return dictionary
 
+    @classmethod
+    def fromRows(cls, rows):
+        for row in rows:
+            yield cls.fromRow(row)
+
+    @classmethod
+    def recordsByUUID(cls, indexes=()):
+        collection = Collection(cls, indexes)
+        collection.recordsByUUID()
+        return collection
+
+class Model(Persistent):
+    _observable = True
+
+    def __init__(self, *initial_data, **kwargs):
+        self._keys = {}
+        self._dirty = None
+        self._observers = []
+        
+        for dictionary in initial_data:
+            for key in dictionary:
+                self.setAttribute(key, dictionary[key])
+        for key in kwargs:
+            self.setAttribute(key, kwargs[key])
+        
+        if not self.hasAttribute('uuid'):
+            self.setAttribute("uuid", str(uuid.uuid4()))
+
+        self._persisted = False
+        self._clean = False
+
+        self.afterInit()
+
+    """DB-based attributes"""
+    def setAttribute(self, key, value):
+        if key not in self._keys:
+            self._keys[key] = True
+            self.markDirty(key)
+            previous = None
+        else:
+            previous = getattr(self, key)
+            if previous == value:
+                setattr(self, key, value)
+                return
+            self.markDirty(key)
+
+        setattr(self, key, value)
+
+        for collection in self._observers:
+            collection.reindex(self, key, previous, value)
+
+    """DB-based attributes"""
+    def hasAttribute(self, key):
+        return hasattr(self, key) and (key in self._keys)
+
+    def attributeNames(self):
+        return self._keys
+
     @classmethod
     def fromRow(cls, row):
         dictionary = {}
@@ -117,26 +300,161 @@ class Model(object):
             dictionary[key] = row[key]
         return cls(dictionary).fromDB()
 
+class Record(Persistent):
+    """Compact slotted model for high-volume tables; index it only by columns that never change after load"""
+    __slots__ = ('_persisted', '_clean', '_dirty')
+
+    def __init__(self, *initial_data, **kwargs):
+        self._dirty = None
+
+        for dictionary in initial_data:
+            for key in dictionary:
+                self.setAttribute(key, dictionary[key])
+        for key in kwargs:
+            self.setAttribute(key, kwargs[key])
+
+        if not self.hasAttribute('uuid'):
+            self.setAttribute("uuid", str(uuid.uuid4()))
+
+        self._persisted = False
+        self._clean = False
+
+        self.afterInit()
+
+    """DB-based attributes"""
+    def setAttribute(self, key, value):
+        if getattr(self, key, self) != value:
+            self.markDirty(key)
+
+        setattr(self, key, value)
+
+    """DB-based attributes"""
+    def hasAttribute(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def attributeNames(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
     @classmethod
-    def recordsByUUID(cls):
-        collection = Collection(cls)
-        collection.recordsByUUID()
-        return collection
+    def fromRows(cls, rows):
+        """Load rows straight into slots, resolving column positions once"""
+        columns = None
+
+        for row in rows:
+            if columns is None:
+                columns = [(index, key) for index, key in enumerate(row.keys()) if key in cls.__slots__]
+
+            record = cls.__new__(cls)
+            for index, key in columns:
+                setattr(record, key, row[index])
+            record._persisted = True
+            record._clean = True
+            record._dirty = None
+            record.afterInit()
+
+            yield record
+
+    @classmethod
+    def fromRow(cls, row):
+        return next(cls.fromRows((row,)))
 
 class Collection(object):
-    def __init__(self, model_class):
+    """Records of one model keyed by uuid, with optional secondary indexes kept current as records change"""
+
+    def __init__(self, model_class, indexes=()):
         self.model_class = model_class
         self.records = {}
+        self.indexes = {}
+
+        for param in indexes:
+            self.addIndex(param)
+
+    def addIndex(self, param):
+        if param in self.indexes:
+            return
+
+        self.indexes[param] = {}
+
+        for model in self.iterate():
+            self.indexes[param].setdefault(model.getAttribute(param), {})[model.uuid] = model
+            if model._observable and self not in model._observers:
+                model._observers.append(self)
+
+    def storeRecord(self, model):
+        previous = self.records.get(model.uuid)
+        if previous is not None and previous is not model:
+            self.unindexRecord(previous)
+
+        self.records[model.uuid] = model
+
+        if self.indexes and previous is not model:
+            for param in self.indexes:
+                self.indexes[param].setdefault(model.getAttribute(param), {})[model.uuid] = model
+            if model._observable:
+                model._observers.append(self)
+
+        return model
+
+    def unindexRecord(self, model):
+        if not self.indexes:
+            return
+
+        for param in self.indexes:
+            bucket = self.indexes[param].get(model.getAttribute(param))
+            if bucket is not None:
+                bucket.pop(model.uuid, None)
+                if not bucket:
+                    del self.indexes[param][model.getAttribute(param)]
+
+        if model._observable and self in model._observers:
+            model._observers.remove(self)
+
+    def reindex(self, model, param, previous, value):
+        if param not in self.indexes or self.records.get(model.uuid) is not model:
+            return
+
+        bucket = self.indexes[param].get(previous)
+        if bucket is not None:
+            bucket.pop(model.uuid, None)
+            if not bucket:
+                del self.indexes[param][previous]
+
+        self.indexes[param].setdefault(value, {})[model.uuid] = model
+
+    def findBy(self, param, value):
+        """Iterate the records whose attribute equals value"""
+        if param in self.indexes:
+            return iter(list(self.indexes[param].get(value, {}).values()))
+
+        return (model for model in self.iterate() if model.getAttribute(param) == value)
 
     def filteredCollection(self, param, value):
         output = Collection(self.model_class)
         
-        for model in self.iterate():
-            if model.getAttribute(param) == value:
-                output.pushExistingModel(model)
+        for model in self.findBy(param, value):
+            output.pushExistingModel(model)
 
         return output
 
+    def groupBy(self, param):
+        """Split into one collection per attribute value in a single pass"""
+        groups = {}
+
+        if param in self.indexes:
+            for value in self.indexes[param]:
+                groups[value] = Collection(self.model_class)
+                for model in self.indexes[param][value].values():
+                    groups[value].pushExistingModel(model)
+            return groups
+
+        for model in self.iterate():
+            value = model.getAttribute(param)
+            if value not in groups:
+                groups[value] = Collection(self.model_class)
+            groups[value].pushExistingModel(model)
+
+        return groups
+
     def recordsByUUID(self):
         db = get_db()
 
@@ -144,8 +462,8 @@ class Collection(object):
             'SELECT * FROM ' + scrub(self.model_class._table)
         ).fetchall()
 
-        for row in rows:
-            self.records[row['uuid']] = self.model_class.fromRow(row=row)
+        for record in self.model_class.fromRows(rows):
+            self.storeRecord(record)
 
     def fetchByUUID(self, uuid):
         if uuid in self.records:
@@ -153,16 +471,48 @@ class Collection(object):
         return None
 
     def pushRows(self, rows):
+        for record in self.model_class.fromRows(rows):
+            self.storeRecord(record)
+
+    def pushRow(self, row):
+        return self.storeRecord(self.model_class.fromRow(row=row))
+
+    def removeByUUID(self, uuid):
+        record = self.records.pop(uuid, None)
+        if record is not None:
+            self.unindexRecord(record)
+        return record
+
+    def sync(self):
+        """Bring the collection in line with its table without replacing unchanged records, returning (added, changed, removed)"""
+        rows = get_db().execute(
+            'SELECT * FROM ' + scrub(self.model_class._table)
+        ).fetchall()
+
+        added = []
+        changed = []
+        seen = set()
+
         for row in rows:
-            self.records[row['uuid']] = self.model_class.fromRow(row=row)
+            seen.add(row['uuid'])
+            record = self.fetchByUUID(row['uuid'])
+
+            if record is None:
+                added.append(self.pushRow(row))
+            elif record.applyRow(row):
+                changed.append(record)
+
+        removed = [record for record in self.iterate() if record.uuid not in seen]
+        for record in removed:
+            self.removeByUUID(record.uuid)
+
+        return added, changed, removed
 
     def pushExistingModel(self, model):
-        self.records[model.uuid] = model
+        self.storeRecord(model)
 
     def addNewRecord(self, dictionary):
-        record = self.model_class(dictionary)
-        self.records[record.uuid] = record
-        return record
+        return self.storeRecord(self.model_class(dictionary))
 
     def iterate(self):
         for key in self.records:
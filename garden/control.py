@@ -0,0 +1,64 @@
+from flask import (
+    Blueprint, current_app, jsonify, request
+)
+
+from garden.auth import green, login_required
+from garden.rpc import call
+
+try:
+    from eventlet import tpool
+except ImportError:
+    tpool = None
+
+bp = Blueprint('control', __name__, url_prefix='/control')
+
+def call_garden(message, timeout=None):
+    """Ask the running control loop; (reply, status) with 503 when it is not reachable"""
+    if timeout is None:
+        timeout = current_app.config['GARDEN_RPC_TIMEOUT']
+
+    path = current_app.config['GARDEN_RPC_SOCKET']
+
+    # the loop may hold a command for up to its own timeout, so wait a little longer
+    args = (path, message, timeout + 1)
+
+    # no socket configured means the loop never opens one
+    if not path:
+        reply = None
+    # under eventlet a blocking wait here would stall every Socket.IO client
+    elif green():
+        reply = tpool.execute(call, *args)
+    else:
+        reply = call(*args)
+
+    if reply is None:
+        return {'ok': False, 'error': 'The control loop is not running.'}, 503
+
+    if not reply.get('ok'):
+        return reply, 409
+
+    return reply, 200
+
+@bp.route('/state', methods=['GET'])
+@login_required
+def state():
+    section = request.args.get('section', 'state')
+    reply, status = call_garden({'query': section})
+    return jsonify(reply), status
+
+@bp.route('/relays/<relay_uuid>/manual', methods=['POST'])
+@login_required
+def set_manual(relay_uuid):
+    value = request.form.get('manual')
+
+    payload = request.get_json(silent=True)
+    if value is None and isinstance(payload, dict):
+        value = payload.get('manual')
+
+    if value is None:
+        return jsonify(ok=False, error='manual is required.'), 400
+
+    manual = value in (True, 1) or str(value).lower() in ('1', 'true', 'on')
+
+    reply, status = call_garden({'command': 'setManual', 'relay_uuid': relay_uuid, 'manual': manual})
+    return jsonify(reply), status
@@ -0,0 +1,134 @@
+import datetime
+import json
+import math
+
+from flask import (
+    Blueprint, Response, jsonify, request, stream_with_context
+)
+
+from garden.auth import login_required
+from garden.db import get_read_db
+
+bp = Blueprint('data', __name__, url_prefix='/data')
+
+_fetch_size = 500
+_max_points = 5000
+
+_rollup_query = '''SELECT
+        strftime('%%Y-%%m-%%dT%%H:%%M:%%S', :origin + ((CAST(strftime('%%s', bucket) AS INTEGER) - :origin) / :width) * :width, 'unixepoch') AS time,
+        min(min_value) AS min_value,
+        max(max_value) AS max_value,
+        1.0 * sum(sum_value) / sum(sample_count) AS mean_value,
+        sum(sample_count) AS sample_count
+    FROM %s
+    WHERE sensor_uuid = :sensor_uuid AND bucket >= :start AND bucket < :end
+    GROUP BY (CAST(strftime('%%s', bucket) AS INTEGER) - :origin) / :width
+    ORDER BY 1'''
+
+_minute_query = '''SELECT
+        strftime('%Y-%m-%dT%H:%M:%S', :origin + ((CAST(strftime('%s', recorded_at) AS INTEGER) - :origin) / :width) * :width, 'unixepoch') AS time,
+        min(coalesce(min_value, recorded_value)) AS min_value,
+        max(coalesce(max_value, recorded_value)) AS max_value,
+        1.0 * sum(coalesce(mean_value, recorded_value) * sample_count) / sum(sample_count) AS mean_value,
+        sum(sample_count) AS sample_count
+    FROM measurement
+    WHERE sensor_uuid = :sensor_uuid AND recorded_at >= :start AND recorded_at < :end
+    GROUP BY (CAST(strftime('%s', recorded_at) AS INTEGER) - :origin) / :width
+    ORDER BY 1'''
+
+_raw_query = '''SELECT
+        strftime('%Y-%m-%dT%H:%M:%S', :origin + ((CAST(strftime('%s', recorded_at) AS INTEGER) - :origin) / :width) * :width, 'unixepoch') AS time,
+        min(recorded_value) AS min_value,
+        max(recorded_value) AS max_value,
+        avg(recorded_value) AS mean_value,
+        count(*) AS sample_count
+    FROM measurement
+    WHERE sensor_uuid = :sensor_uuid AND recorded_at >= :start AND recorded_at < :end
+    GROUP BY (CAST(strftime('%s', recorded_at) AS INTEGER) - :origin) / :width
+    ORDER BY 1'''
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def parse_time(value):
+    """Measurements are stored in naive UTC; times without an offset are taken as UTC"""
+    parsed = datetime.datetime.fromisoformat(value)
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
+def table_exists(db, name):
+    row = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+def select_query(db, width):
+    """Pick the coarsest source whose resolution still fits the bucket width, with that resolution in seconds"""
+    if not table_exists(db, 'measurement_hourly'):
+        return _raw_query, None
+
+    if width >= 86400 and table_exists(db, 'measurement_daily'):
+        return _rollup_query % 'measurement_daily', 86400
+
+    if width >= 3600:
+        return _rollup_query % 'measurement_hourly', 3600
+
+    return _minute_query, None
+
+def bucket_floor(value, resolution):
+    """Start of the rollup bucket holding value"""
+    if resolution == 86400:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if resolution == 3600:
+        return value.replace(minute=0, second=0, microsecond=0)
+
+    return value
+
+def stream_rows(cursor):
+    while True:
+        rows = cursor.fetchmany(_fetch_size)
+        if not rows:
+            break
+        yield ''.join(json.dumps(dict(zip(row.keys(), row))) + '\n' for row in rows)
+
+@bp.route('/sensors/<sensor_uuid>/measurements', methods=['GET'])
+@login_required
+def measurements(sensor_uuid):
+    error = None
+
+    try:
+        end = parse_time(request.args['end']) if 'end' in request.args else utc_now()
+        start = parse_time(request.args['start']) if 'start' in request.args else end - datetime.timedelta(hours=24)
+        points = int(request.args.get('points', 500))
+    except ValueError:
+        error = 'Invalid start, end or points.'
+    else:
+        if start >= end:
+            error = 'Start must be before end.'
+        elif points < 1 or points > _max_points:
+            error = 'Points must be between 1 and %d.' % _max_points
+
+    if error is not None:
+        return jsonify(error=error), 400
+
+    # buckets count from start and the width rounds up, so there are at most `points` of them
+    origin = int(start.replace(tzinfo=datetime.timezone.utc).timestamp())
+    width = max(1, math.ceil((end.replace(tzinfo=datetime.timezone.utc).timestamp() - origin) / points))
+
+    db = get_read_db()
+    query, resolution = select_query(db, width)
+
+    # the rollup row holding start covers part of the range too
+    cursor = db.execute(query, {
+        'sensor_uuid': sensor_uuid,
+        'start': bucket_floor(start, resolution),
+        'end': end,
+        'width': width,
+        'origin': origin,
+    })
+
+    return Response(stream_with_context(stream_rows(cursor)), mimetype='application/x-ndjson')
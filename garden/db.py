@@ -1,26 +1,160 @@
+import os
+import re
 import sqlite3
+import threading
+import urllib.request
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
 
+class ConnectionPool(object):
+    """Long-lived SQLite connections lent out for one app context at a time"""
+
+    def __init__(self, path, read_only=False, size=8, cached_statements=256, pragmas=()):
+        self.path = path
+        self.read_only = read_only
+        self.size = size
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas
+        self.lock = threading.Lock()
+        self.idle = []
+        self.pid = os.getpid()
+
+    def connect(self):
+        if self.read_only:
+            target = 'file:%s?mode=ro' % urllib.request.pathname2url(os.path.abspath(self.path))
+        else:
+            target = self.path
+
+        connection = sqlite3.connect(
+            target,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            uri=self.read_only
+        )
+        connection.row_factory = sqlite3.Row
+
+        for pragma in self.pragmas:
+            connection.execute('PRAGMA ' + pragma)
+
+        return connection
+
+    def checkout(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle = []
+                self.pid = os.getpid()
+
+            if self.idle:
+                return self.idle.pop()
+
+        return self.connect()
+
+    def checkin(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+
+        connection.set_trace_callback(None)
+
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for connection in idle:
+            connection.close()
+
+def get_pool(kind):
+    pools = current_app.extensions.setdefault('garden_db', {})
+
+    if kind not in pools:
+        config = current_app.config
+        pragmas = [
+            'busy_timeout = %d' % config['GARDEN_DB_BUSY_TIMEOUT'],
+            'mmap_size = %d' % config['GARDEN_DB_MMAP_SIZE'],
+            'cache_size = %d' % config['GARDEN_DB_CACHE_SIZE'],
+        ]
+
+        if kind == 'read':
+            pragmas.append('query_only = 1')
+        else:
+            pragmas.extend(['journal_mode = WAL', 'synchronous = NORMAL'])
+
+        pools[kind] = ConnectionPool(
+            config['DATABASE'],
+            read_only=(kind == 'read'),
+            size=config['GARDEN_DB_POOL_SIZE'],
+            cached_statements=config['GARDEN_DB_CACHED_STATEMENTS'],
+            pragmas=pragmas
+        )
+
+    return pools[kind]
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool('write').checkout()
 
     return g.db
 
+def get_read_db():
+    """Read-only connection for API queries; WAL lets it read while the control loop writes"""
+    if 'read_db' not in g:
+        g.read_db = get_pool('read').checkout()
+
+    return g.read_db
+
 
 def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        get_pool('write').checkin(db)
+
+    read_db = g.pop('read_db', None)
+
+    if read_db is not None:
+        get_pool('read').checkin(read_db)
+
+def list_migrations():
+    """Return (version, filename) pairs for the shipped migrations, in order"""
+    migrations = []
+
+    for name in os.listdir(os.path.join(current_app.root_path, 'migrations')):
+        match = re.match(r'^(\d+)_\w+\.sql$', name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+
+    return sorted(migrations)
+
+def migrate_db():
+    """Apply every migration newer than the database's user_version"""
+    db = get_db()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+
+    for number, name in list_migrations():
+        if number <= version:
+            continue
+
+        with current_app.open_resource('migrations/' + name) as f:
+            script = f.read().decode('utf8')
+
+        # the version bump shares the migration's transaction
+        db.executescript('BEGIN;\n' + script + '\nPRAGMA user_version = %d;\nCOMMIT;' % number)
+        applied.append(name)
+
+    db.execute('PRAGMA journal_mode = WAL')
+
+    return applied
 
 def init_db():
     db = get_db()
@@ -28,6 +162,9 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    db.execute('PRAGMA user_version = 0')
+    migrate_db()
+
 @click.command('init-db')
 @with_appcontext
 def init_db_command():
@@ -35,6 +172,15 @@ def init_db_command():
     init_db()
     click.echo('Initialized the database')
 
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Apply pending migrations without clearing data."""
+    for name in migrate_db():
+        click.echo('Applied %s' % name)
+    click.echo('Database is up to date')
+
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
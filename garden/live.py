@@ -0,0 +1,241 @@
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+from flask import g, request
+from flask_socketio import emit
+
+from garden import socketio
+
+def encode(kind, data):
+    return (json.dumps({'type': kind, 'data': data}) + '\n').encode('utf8')
+
+def merge(target, delta):
+    for section in delta:
+        target.setdefault(section, {}).update(delta[section])
+
+class LivePublisher(object):
+    """Stream control loop state to web workers as a snapshot and then per-tick deltas over a Unix socket"""
+
+    _max_backlog = 4 * 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = []
+        self.server = None
+
+    def open(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(16)
+        self.server.setblocking(False)
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber['socket'].close()
+        self.subscribers = []
+
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def publish(self, delta, snapshot):
+        if self.server is None:
+            return
+
+        self.acceptSubscribers(snapshot)
+
+        # every tick also drains what earlier ticks could not send
+        message = encode('delta', delta) if delta else None
+        self.subscribers = [subscriber for subscriber in self.subscribers if self.send(subscriber, message)]
+
+    def acceptSubscribers(self, snapshot):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            connection.setblocking(False)
+            subscriber = {'socket': connection, 'outgoing': bytearray()}
+
+            if self.send(subscriber, encode('snapshot', snapshot)):
+                self.subscribers.append(subscriber)
+
+    def send(self, subscriber, message):
+        """Queue message and write as much as the socket takes; False once the subscriber is dropped"""
+        outgoing = subscriber['outgoing']
+
+        if message is not None:
+            outgoing += message
+
+        if len(outgoing) > self._max_backlog:
+            subscriber['socket'].close()
+            return False
+
+        try:
+            while outgoing:
+                sent = subscriber['socket'].send(outgoing)
+                del outgoing[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            subscriber['socket'].close()
+            return False
+
+        return True
+
+class LiveHub(object):
+    """Fan control loop deltas out to Socket.IO clients, merged and emitted at most once per client interval"""
+
+    def __init__(self):
+        self.path = None
+        self.min_interval = 1.0
+        self.lock = threading.Lock()
+        self.state = {}
+        self.clients = {}
+        self.started = False
+
+    def configure(self, path, min_interval):
+        self.path = path
+        self.min_interval = min_interval
+
+    def start(self):
+        if self.started:
+            return
+
+        self.started = True
+        if self.path:
+            socketio.start_background_task(self.listen)
+        socketio.start_background_task(self.dispatch)
+
+    def addClient(self, sid):
+        with self.lock:
+            self.clients[sid] = {'pending': {}, 'interval': self.min_interval, 'last_emit': time.monotonic()}
+            return dict((section, dict(self.state[section])) for section in self.state)
+
+    def removeClient(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def setInterval(self, sid, interval):
+        with self.lock:
+            if sid in self.clients:
+                self.clients[sid]['interval'] = max(self.min_interval, interval)
+
+    def apply(self, message):
+        with self.lock:
+            if message['type'] == 'snapshot':
+                self.state = message['data']
+                for sid in self.clients:
+                    self.clients[sid]['pending'] = dict((section, dict(self.state[section])) for section in self.state)
+            else:
+                merge(self.state, message['data'])
+                for sid in self.clients:
+                    merge(self.clients[sid]['pending'], message['data'])
+
+    def listen(self):
+        """Follow the publisher socket, reconnecting whenever it goes away"""
+        while True:
+            subscriber = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                subscriber.connect(self.path)
+            except OSError:
+                subscriber.close()
+                socketio.sleep(2)
+                continue
+
+            subscriber.setblocking(False)
+            buffered = b''
+
+            while True:
+                try:
+                    chunk = subscriber.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    socketio.sleep(0.05)
+                    continue
+                except OSError:
+                    break
+
+                if not chunk:
+                    break
+
+                buffered += chunk
+                while b'\n' in buffered:
+                    line, buffered = buffered.split(b'\n', 1)
+                    self.apply(json.loads(line.decode('utf8')))
+
+            subscriber.close()
+
+    def dispatch(self):
+        while True:
+            socketio.sleep(min(self.min_interval, 0.25))
+            self.emitPending()
+
+    def emitPending(self):
+        """Emit each client's merged deltas once its interval has passed"""
+        current_time = time.monotonic()
+        outgoing = []
+
+        with self.lock:
+            for sid in self.clients:
+                client = self.clients[sid]
+
+                if client['pending'] and current_time - client['last_emit'] >= client['interval']:
+                    outgoing.append((sid, client['pending']))
+                    client['pending'] = {}
+                    client['last_emit'] = current_time
+
+        for sid, delta in outgoing:
+            socketio.emit('delta', delta, room=sid)
+
+hub = LiveHub()
+
+@socketio.on('connect')
+def connect():
+    # imported here: auth imports the models, which import this module
+    from garden.auth import load_authenticated_client
+
+    # Socket.IO handlers skip before_app_request, so run the same checks here
+    load_authenticated_client()
+
+    if g.client is None:
+        return False
+
+    hub.start()
+    emit('snapshot', hub.addClient(request.sid))
+
+@socketio.on('disconnect')
+def disconnect():
+    hub.removeClient(request.sid)
+
+@socketio.on('subscribe')
+def subscribe(options):
+    if not isinstance(options, dict) or 'interval' not in options:
+        return
+
+    # clients send anything; ignore intervals that are not a usable number
+    try:
+        interval = float(options['interval'])
+    except (TypeError, ValueError):
+        return
+
+    if math.isfinite(interval):
+        hub.setInterval(request.sid, interval)
+
+def init_app(app):
+    hub.configure(app.config['GARDEN_LIVE_SOCKET'], app.config['GARDEN_LIVE_MIN_INTERVAL'])
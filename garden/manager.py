@@ -1,7 +1,9 @@
 import click
 from flask import g
 from flask.cli import with_appcontext
+from garden.metrics import read_published
 from garden.model import Garden
+from garden.simulator import Simulation
 
 def get_garden():
     if 'garden' not in g:
@@ -28,6 +30,45 @@ def iterate_garden_command():
 
     g.garden.iterate()
 
+@click.command('garden-metrics')
+@with_appcontext
+def garden_metrics_command():
+    """Print the latest metrics published by iterate-garden."""
+    output = read_published()
+
+    if output is None:
+        click.echo('No metrics published yet.')
+    else:
+        click.echo(output, nl=False)
+
+@click.command('simulate-garden')
+@click.option('--boards', default=2, help='Number of virtual boards.')
+@click.option('--sensors', default=4, help='Sensors per board.')
+@click.option('--relays', default=4, help='Relays per board.')
+@click.option('--ticks', default=100, help='Control loop ticks to time.')
+@click.option('--latency', default=0.005, help='Seconds before a board replies.')
+@click.option('--jitter', default=0.002, help='Random spread added to the latency, in seconds.')
+@click.option('--drop-rate', default=0.0, help='Fraction of replies a board never sends.')
+@click.option('--unplug-every', default=0, help='Unplug a board for one tick every this many ticks.')
+@click.option('--batch/--no-batch', default=True, help='Whether boards answer batched sensor reads.')
+@click.option('--concurrent/--sequential', default=False, help='Talk to boards in parallel.')
+@click.option('--seed', default=None, type=int, help='Seed for board uuids, jitter and drops.')
+def simulate_garden_command(boards, sensors, relays, ticks, latency, jitter, drop_rate, unplug_every, batch, concurrent, seed):
+    """Time the control loop against simulated boards in a scratch database."""
+    simulation = Simulation(
+            boards=boards,
+            sensors=sensors,
+            relays=relays,
+            latency=latency,
+            jitter=jitter,
+            drop_rate=drop_rate,
+            unplug_every=unplug_every,
+            batch=batch,
+            concurrent=concurrent,
+            seed=seed)
+
+    simulation.run(ticks)
+
 def disconnect_garden(e=None):
     if 'garden' in g:
         if g.garden.isIterator():
@@ -36,4 +77,6 @@ def disconnect_garden(e=None):
 def init_app(app):
     app.cli.add_command(get_garden_command)
     app.cli.add_command(iterate_garden_command)
+    app.cli.add_command(garden_metrics_command)
+    app.cli.add_command(simulate_garden_command)
     app.teardown_appcontext(disconnect_garden)
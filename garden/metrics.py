@@ -0,0 +1,115 @@
+import os
+import threading
+
+from flask import Blueprint, Response, current_app
+
+bp = Blueprint('metrics', __name__)
+
+_default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels, extra=None):
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+class Histogram(object):
+    def __init__(self, buckets=_default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels, ('le', repr(bound))), cumulative))
+        lines.append('%s_bucket%s %d' % (name, format_labels(labels, ('le', '+Inf')), self.count))
+        lines.append('%s_sum%s %r' % (name, format_labels(labels), self.sum))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), self.count))
+        return lines
+
+class Metrics(object):
+    """Process-wide registry of latency histograms and event counters, published as a Prometheus text file"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted(self.histograms):
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s histogram' % name)
+                for labels in sorted(self.histograms[name]):
+                    lines.extend(self.histograms[name][labels].render(name, labels))
+            for name in sorted(self.counters):
+                if name in self.help:
+                    lines.append('# HELP %s %s' % (name, self.help[name]))
+                lines.append('# TYPE %s counter' % name)
+                for labels in sorted(self.counters[name]):
+                    lines.append('%s%s %d' % (name, format_labels(labels), self.counters[name][labels]))
+        return '\n'.join(lines) + '\n'
+
+    def writeFile(self, path):
+        """Atomically replace the published metrics file"""
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+metrics = Metrics()
+metrics.describe('garden_tick_seconds', 'Duration of a full control loop tick.')
+metrics.describe('garden_stage_seconds', 'Duration of each control loop stage.')
+metrics.describe('garden_serial_roundtrip_seconds', 'Serial request/response round trip by slave and command.')
+metrics.describe('garden_serial_timeouts_total', 'Serial requests that received no response.')
+metrics.describe('garden_serial_exceptions_total', 'SerialExceptions raised during an exchange.')
+
+def read_published():
+    try:
+        with open(current_app.config['GARDEN_METRICS_FILE']) as f:
+            return f.read()
+    except OSError:
+        return None
+
+@bp.route('/metrics')
+def published_metrics():
+    output = read_published()
+
+    if output is None:
+        return Response('# no metrics published yet\n', status=503, mimetype='text/plain')
+
+    return Response(output, mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS activation_rule_end ON activation (rule_uuid, end_time);
+CREATE INDEX IF NOT EXISTS activation_relay_end ON activation (relay_uuid, end_time);
+CREATE INDEX IF NOT EXISTS measurement_sensor_recorded_at ON measurement (sensor_uuid, recorded_at);
@@ -0,0 +1,61 @@
+ALTER TABLE measurement ADD COLUMN min_value DECIMAL(10,5) NULL;
+ALTER TABLE measurement ADD COLUMN max_value DECIMAL(10,5) NULL;
+ALTER TABLE measurement ADD COLUMN mean_value DECIMAL(10,5) NULL;
+ALTER TABLE measurement ADD COLUMN sample_count INTEGER NOT NULL DEFAULT 1;
+
+CREATE TABLE measurement_hourly(
+  sensor_uuid VARCHAR(36) NOT NULL,
+  bucket TIMESTAMP NOT NULL,
+  min_value DECIMAL(10,5) NULL,
+  max_value DECIMAL(10,5) NULL,
+  sum_value DECIMAL(10,5) NULL,
+  sample_count INTEGER NOT NULL DEFAULT 0,
+  last_value DECIMAL(10,5) NULL,
+  PRIMARY KEY (sensor_uuid, bucket),
+  FOREIGN KEY (sensor_uuid) REFERENCES sensor (uuid)
+);
+
+CREATE TABLE measurement_daily(
+  sensor_uuid VARCHAR(36) NOT NULL,
+  bucket TIMESTAMP NOT NULL,
+  min_value DECIMAL(10,5) NULL,
+  max_value DECIMAL(10,5) NULL,
+  sum_value DECIMAL(10,5) NULL,
+  sample_count INTEGER NOT NULL DEFAULT 0,
+  last_value DECIMAL(10,5) NULL,
+  PRIMARY KEY (sensor_uuid, bucket),
+  FOREIGN KEY (sensor_uuid) REFERENCES sensor (uuid)
+);
+
+-- backfill from rows recorded before the upgrade; their recorded_at is UTC from CURRENT_TIMESTAMP
+INSERT INTO measurement_hourly (sensor_uuid, bucket, min_value, max_value, sum_value, sample_count, last_value)
+SELECT sensor_uuid, bucket, min_value, max_value, sum_value, sample_count,
+    (SELECT recorded_value FROM measurement AS latest
+        WHERE latest.sensor_uuid = buckets.sensor_uuid
+        AND latest.recorded_at >= buckets.bucket AND latest.recorded_at < datetime(buckets.bucket, '+1 hour')
+        AND latest.recorded_value IS NOT NULL
+        ORDER BY latest.recorded_at DESC LIMIT 1)
+FROM (SELECT sensor_uuid,
+        strftime('%Y-%m-%d %H:00:00', recorded_at) AS bucket,
+        min(recorded_value) AS min_value,
+        max(recorded_value) AS max_value,
+        sum(recorded_value) AS sum_value,
+        count(*) AS sample_count
+    FROM measurement
+    WHERE recorded_value IS NOT NULL
+    GROUP BY sensor_uuid, bucket) AS buckets;
+
+INSERT INTO measurement_daily (sensor_uuid, bucket, min_value, max_value, sum_value, sample_count, last_value)
+SELECT sensor_uuid, bucket, min_value, max_value, sum_value, sample_count,
+    (SELECT last_value FROM measurement_hourly AS latest
+        WHERE latest.sensor_uuid = buckets.sensor_uuid
+        AND latest.bucket >= buckets.bucket AND latest.bucket < datetime(buckets.bucket, '+1 day')
+        ORDER BY latest.bucket DESC LIMIT 1)
+FROM (SELECT sensor_uuid,
+        strftime('%Y-%m-%d 00:00:00', bucket) AS bucket,
+        min(min_value) AS min_value,
+        max(max_value) AS max_value,
+        sum(sum_value) AS sum_value,
+        sum(sample_count) AS sample_count
+    FROM measurement_hourly
+    GROUP BY sensor_uuid, strftime('%Y-%m-%d 00:00:00', bucket)) AS buckets;
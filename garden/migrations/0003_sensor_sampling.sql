@@ -0,0 +1,2 @@
+ALTER TABLE sensor ADD COLUMN sample_interval INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE sensor ADD COLUMN priority INTEGER NOT NULL DEFAULT 0;
@@ -1,61 +1,266 @@
 import click
-import serial.tools.list_ports
+import collections
+import glob
+import heapq
+import os
+import serial
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from garden.db import get_db
-from garden.base import Model, Collection
+from garden.base import Model, Record, Collection, enable_write_behind, execute_deferred, get_write_behind
+from garden.live import LivePublisher
+from garden.metrics import metrics
+from garden.rpc import ControlServer
+from garden.ticker import TickScheduler
 import PyCmdMessenger
 import datetime
 import time
 
+def changedKeys(previous, current):
+    """Keys whose value differs between two snapshots, including added and removed keys"""
+    changed = set()
+
+    for key in current:
+        if key not in previous or previous[key] != current[key]:
+            changed.add(key)
+
+    for key in previous:
+        if key not in current:
+            changed.add(key)
+
+    return changed
+
 class Garden(object):
 
+    _stages = ['reloadConfig',
+            'resetOfflineOnline',
+            'makeConnections',
+            'updateSlaves',
+            'checkSchedule',
+            'readActiveSensors',
+            'applyCommands',
+            'calculateForcedRelays',
+            'checkRules',
+            'contactRelays',
+            'publishState',
+            'flushWrites']
+
     def __init__(self):
+        self.config = current_app.config
         self.initializeRecords()
 
         self.iterator = False
         self.connection_manager = None
+        self.ticker = None
+        self.last_flush = 0
+        self.publisher = None
+        self.published_state = {}
+        self.control = None
         self.readings = {}
+        self.changed_sensors = set()
         self.scheduler = {}
+        self.changed_schedules = set()
         self.relay_signals = {}
         self.relay_results = {}
 
     def initializeRecords(self):
+        self.terminateOpenActivations()
+
         self.slaves = Slave.recordsByUUID()
         self.sensors = Sensor.recordsByUUID()
         self.relays = Relay.recordsByUUID()
         self.schedules = Schedule.recordsByUUID()
-        self.rules = Rule.recordsByUUID()
-        self.elements = Element.recordsByUUID()
-        self.consequences = Consequence.recordsByUUID()
-        self.rule_limits = RuleLimit.recordsByUUID()
+        self.rules = Rule.recordsByUUID(indexes=('schedule_uuid',))
+        self.elements = Element.recordsByUUID(indexes=('rule_uuid', 'sensor_uuid'))
+        self.consequences = Consequence.recordsByUUID(indexes=('rule_uuid',))
+        self.rule_limits = RuleLimit.recordsByUUID(indexes=('rule_uuid',))
+        self.timeline = ScheduleTimeline()
+
+        elements = self.elements.groupBy('rule_uuid')
+        consequences = self.consequences.groupBy('rule_uuid')
+        rule_limits = self.rule_limits.groupBy('rule_uuid')
+        activations = self.recentRuleActivations().groupBy('rule_uuid')
 
         for rule in self.rules.iterate():
+            rule.setChildParams(
+                    elements.get(rule.uuid, Collection(Element)),
+                    consequences.get(rule.uuid, Collection(Consequence)),
+                    rule_limits.get(rule.uuid, Collection(RuleLimit)),
+                    activations.get(rule.uuid, Collection(Activation)))
+
+        self.indexRules()
+        self.active_rules = set()
+        self.unsettled_rules = set(rule.uuid for rule in self.rules.iterate())
+        self.data_version = self.dataVersion()
+
+    def terminateOpenActivations(self):
+        """Close every activation left open by a previous run in one statement"""
+        db = get_db()
+        db.execute(
+            'UPDATE activation SET end_time = last_update, last_update = ? WHERE end_time IS NULL', (datetime.datetime.now(),)
+        )
+        db.commit()
+
+    def recentRuleActivations(self):
+        back_in_time = datetime.datetime.now() - datetime.timedelta(hours = 24)
+
+        rows = get_db().execute(
+            'SELECT * FROM activation WHERE rule_uuid IS NOT NULL AND end_time >= ?', (back_in_time,)
+        ).fetchall()
+
+        activations = Collection(Activation)
+        activations.pushRows(rows)
+        return activations
+
+    def indexRules(self):
+        """Map sensors and schedules to the rules that depend on them"""
+        self.rules_by_sensor = {}
+        self.rules_by_schedule = {}
+
+        for schedule_uuid, rules in self.rules.groupBy('schedule_uuid').items():
+            self.rules_by_schedule[schedule_uuid] = set(rules.records)
+
+        for sensor_uuid, elements in self.elements.groupBy('sensor_uuid').items():
+            self.rules_by_sensor[sensor_uuid] = set(element.rule_uuid for element in elements.iterate() if self.rules.fetchByUUID(element.rule_uuid) is not None)
+
+    def dataVersion(self):
+        """Changes whenever another connection commits to the database"""
+        return get_db().execute('PRAGMA data_version').fetchone()[0]
+
+    def reloadConfig(self):
+        version = self.dataVersion()
+
+        if version == self.data_version:
+            return
+
+        self.data_version = version
+        self.applyConfigChanges()
+
+    def applyConfigChanges(self):
+        """Apply edited, added and removed configuration rows in place, keeping the state of unchanged records"""
+        # rule history queries below must see activations still in the queue
+        self.flushWrites(force=True)
+
+        self.slaves.sync()
+
+        added, changed, removed = self.sensors.sync()
+        for sensor in removed:
+            sensor.flushAccumulator()
+
+        addresses = dict((relay.uuid, (relay.slave_uuid, relay.pin)) for relay in self.relays.iterate())
+        added, changed, removed = self.relays.sync()
+        for relay in changed:
+            # the state confirmed at the old address says nothing about the new one
+            if (relay.slave_uuid, relay.pin) != addresses[relay.uuid]:
+                relay.forgetConfirmedState()
+        for relay in added:
+            relay.terminateOpenActivations()
+        for relay in removed:
+            relay.endActivation()
+
+        added, changed, removed = self.schedules.sync()
+        if added or changed or removed:
+            self.timeline.invalidate()
+
+        affected = set()
+
+        for children in (self.elements, self.consequences, self.rule_limits):
+            owners = {}
+            for rule in self.rules.iterate():
+                for uuid in rule.childUUIDs():
+                    owners[uuid] = rule.uuid
+
+            for records in children.sync():
+                for record in records:
+                    affected.add(record.rule_uuid)
+                    if record.uuid in owners:
+                        affected.add(owners[record.uuid])
+
+        added, changed, removed = self.rules.sync()
+
+        for rule in removed:
+            rule.endActivation()
+            self.active_rules.discard(rule.uuid)
+            self.unsettled_rules.discard(rule.uuid)
+
+        for rule in added:
             rule.setChildParams(
                     self.elements.filteredCollection('rule_uuid', rule.uuid),
                     self.consequences.filteredCollection('rule_uuid', rule.uuid),
                     self.rule_limits.filteredCollection('rule_uuid', rule.uuid))
+            self.unsettled_rules.add(rule.uuid)
+
+        for rule in changed:
+            rule.invalidate()
+            self.unsettled_rules.add(rule.uuid)
+
+        for uuid in affected:
+            rule = self.rules.fetchByUUID(uuid)
+
+            if rule is not None and rule not in added:
+                rule.refreshChildren(
+                        self.elements.filteredCollection('rule_uuid', rule.uuid),
+                        self.consequences.filteredCollection('rule_uuid', rule.uuid),
+                        self.rule_limits.filteredCollection('rule_uuid', rule.uuid))
+                self.unsettled_rules.add(rule.uuid)
+
+        self.indexRules()
+        click.echo("Configuration reloaded.")
     def setIterator(self):
         self.iterator = True
+        if self.config['GARDEN_WRITE_BEHIND']:
+            enable_write_behind()
+        if self.publisher is None and self.config['GARDEN_LIVE_SOCKET']:
+            self.publisher = LivePublisher(self.config['GARDEN_LIVE_SOCKET'])
+            self.publisher.open()
+        if self.control is None and self.config['GARDEN_RPC_SOCKET']:
+            self.control = ControlServer(self.config['GARDEN_RPC_SOCKET'], self.config['GARDEN_RPC_TIMEOUT'])
+            self.control.open()
         if self.connection_manager is None:
-            self.connection_manager = ConnectionManager()
+            self.connection_manager = ConnectionManager(
+                    concurrent=self.config['GARDEN_CONCURRENT_IO'],
+                    batch_reads=self.config['GARDEN_BATCH_SENSOR_READS'],
+                    device_pattern=self.config['GARDEN_DEVICE_PATTERN'],
+                    heartbeat_interval=self.config['GARDEN_UUID_HEARTBEAT'],
+                    read_timeout=self.config['GARDEN_SERIAL_TIMEOUT'])
 
     def isIterator(self):
         return self.iterator
 
     def iterate(self):
         self.setIterator()
+        self.ticker = TickScheduler(
+                self.config['GARDEN_TICK_PERIOD'],
+                budgets=self.config['GARDEN_STAGE_BUDGETS'],
+                report_every=self.config['GARDEN_TICK_REPORT_EVERY'])
+        
+        last_published = 0
         
         while True:
+            self.ticker.waitForDeadline()
+            started = time.monotonic()
             self.tickLoop()
+            metrics.observe('garden_tick_seconds', time.monotonic() - started)
+            self.ticker.completeTick()
+
+            if time.monotonic() - last_published >= self.config['GARDEN_METRICS_INTERVAL']:
+                metrics.writeFile(self.config['GARDEN_METRICS_FILE'])
+                last_published = time.monotonic()
 
     def tickLoop(self):
-        self.resetOfflineOnline()
+        for stage in self._stages:
+            started = time.monotonic()
+            getattr(self, stage)()
+            self.recordStage(stage, time.monotonic() - started)
+
+    def recordStage(self, stage, elapsed):
+        metrics.observe('garden_stage_seconds', elapsed, stage=stage)
+
+        if self.ticker is not None:
+            self.ticker.recordStage(stage, elapsed)
+
+    def makeConnections(self):
         self.connection_manager.makeConnections()
-        self.updateSlaves()
-        self.readActiveSensors()
-        self.checkSchedule()
-        self.calculateForcedRelays()
-        self.checkRules()
-        self.contactRelays()
 
     def updateSlaves(self):
         online = {}
@@ -83,25 +288,98 @@ class Garden(object):
                 click.echo("Slave marked disconnected in db.")
 
     def readActiveSensors(self):
-        self.readings = {}
         current_time = time.time()
+        available = []
+        due = []
 
         for sensor in self.sensors.iterate():
             slave = self.slaves.fetchByUUID(sensor.slave_uuid)
 
             if sensor.active and slave.connected:
-                reading = self.connection_manager.readSensor(sensor)
-                self.readings[sensor.uuid] = reading
-                sensor.checkAndPersistReading(reading, current_time)
+                available.append(sensor)
+                if sensor.isDue(current_time):
+                    due.append(sensor)
+
+        pending = self.prioritizeReads(due, current_time)
+        results = self.connection_manager.readSensors(pending)
+
+        # persistence stays on this thread, the db connection is not shared with the workers
+        for sensor in pending:
+            sensor.recordRead(results[sensor.uuid], current_time)
+            sensor.checkAndPersistReading(results[sensor.uuid], current_time)
+
+        staleness = self.config['GARDEN_READING_STALENESS']
+        readings = {}
+
+        for sensor in available:
+            readings[sensor.uuid] = sensor.freshReading(current_time, staleness)
+
+        self.changed_sensors = changedKeys(self.readings, readings)
+        self.readings = readings
+
+        for sensor in self.sensors.iterate():
+            sensor.flushElapsedMinute(current_time)
+
+    def prioritizeReads(self, due, current_time):
+        """Order due sensors, urgent first, then by priority and lateness, and cut them to the per-tick budget"""
+        urgent = self.urgentSensors()
+
+        due.sort(key=lambda sensor: (sensor.uuid not in urgent, -sensor.getPriority(), -sensor.overdue(current_time)))
+
+        budget = self.config['GARDEN_SENSOR_READS_PER_TICK']
+        if budget:
+            return due[:budget]
+
+        return due
+
+    def urgentSensors(self):
+        urgent = set()
+
+        for schedule_uuid in self.scheduler:
+            if self.scheduler[schedule_uuid]:
+                for rule in self.rules.findBy('schedule_uuid', schedule_uuid):
+                    for element in rule.elements.iterate():
+                        urgent.add(element.sensor_uuid)
+
+        return urgent
 
     def checkSchedule(self):
-        self.scheduler = {}
+        self.changed_schedules = self.timeline.advance(self.schedules)
+        self.scheduler = self.timeline.states
 
-        for schedule in self.schedules.iterate():
-            if schedule.active and schedule.appliesNow():
-                self.scheduler[schedule.uuid] = True
-            else:
-                self.scheduler[schedule.uuid] = False
+    def applyCommands(self):
+        """Apply commands received over the control socket since the last tick"""
+        if self.control is None:
+            return
+
+        for command in self.control.pendingCommands():
+            # the caller is blocked on this command, so answer it even if applying fails
+            response = {'ok': False, 'error': 'Command failed.'}
+            try:
+                response = self.applyCommand(command.request)
+            except Exception as error:
+                # a bad command must not stop the relays being driven
+                click.echo("Control command %r failed: %s" % (command.request, error))
+            finally:
+                command.resolve(response)
+
+    def applyCommand(self, request):
+        if request['command'] == 'setManual':
+            relay_uuid = request.get('relay_uuid')
+
+            if not isinstance(relay_uuid, str):
+                return {'ok': False, 'error': 'relay_uuid must be a string.'}
+
+            relay = self.relays.fetchByUUID(relay_uuid)
+
+            if relay is None:
+                return {'ok': False, 'error': 'Unknown relay.'}
+
+            relay.set('manual', 1 if request.get('manual') else 0)
+            relay.save(deferred=True)
+            return {'ok': True, 'relay_uuid': relay.uuid, 'manual': bool(relay.manual)}
+
+        return {'ok': False, 'error': 'Unknown command.'}
 
     def calculateForcedRelays(self):
         self.relay_signals = {}
@@ -118,30 +396,127 @@ class Garden(object):
                     relay.cancelForce()
 
     def checkRules(self):
-        for rule in self.rules.iterate():
+        if self.config['GARDEN_INCREMENTAL_RULES']:
+            pending = self.affectedRules()
+        else:
+            pending = set(rule.uuid for rule in self.rules.iterate())
+
+        for uuid in pending:
+            rule = self.rules.fetchByUUID(uuid)
+
+            if rule is None:
+                self.active_rules.discard(uuid)
+                self.unsettled_rules.discard(uuid)
+                continue
+
             if rule.evaluate(self.readings, self.scheduler):
-                for consequence in rule.iterateConsequences():
-                    relay = self.relays.fetchByUUID(consequence.relay_uuid)
-                    
-                    if relay and relay.active:
-                        self.relay_signals[relay.uuid] = True
+                self.active_rules.add(uuid)
+            else:
+                self.active_rules.discard(uuid)
+
+            if rule.needsEvaluation():
+                self.unsettled_rules.add(uuid)
+            else:
+                self.unsettled_rules.discard(uuid)
+
+        for uuid in self.active_rules:
+            rule = self.rules.fetchByUUID(uuid)
+
+            for consequence in rule.iterateConsequences():
+                relay = self.relays.fetchByUUID(consequence.relay_uuid)
+                
+                if relay and relay.active:
+                    self.relay_signals[relay.uuid] = True
+
+    def affectedRules(self):
+        """Rules whose sensors or schedule changed this tick, plus any not yet settled"""
+        affected = set(self.unsettled_rules)
+
+        for sensor_uuid in self.changed_sensors:
+            affected.update(self.rules_by_sensor.get(sensor_uuid, ()))
+
+        for schedule_uuid in self.changed_schedules:
+            affected.update(self.rules_by_schedule.get(schedule_uuid, ()))
+
+        return affected
 
     def contactRelays(self):
         self.relay_results = {}
+        pending = []
 
         for relay in self.relays.iterate():
             if relay.active:
                 if relay.isForced():
-                    self.relay_results[relay.uuid] = self.connection_manager.setRelay(relay)
+                    pending.append(relay)
                 else:
                     if relay.uuid in self.relay_signals and (self.relay_signals[relay.uuid] == True or self.relay_signals[relay.uuid] == False):
                         signal = self.relay_signals[relay.uuid]
                         allowed = relay.setTo(signal)
 
-                        self.relay_results[relay.uuid] = self.connection_manager.setRelay(relay)
+                        pending.append(relay)
                     else:
                         self.relay_results[relay.uuid] = None
 
+        if self.config['GARDEN_RELAY_CHANGE_ONLY']:
+            interval = self.config['GARDEN_RELAY_REASSERT_INTERVAL']
+            writes = []
+
+            for relay in pending:
+                if relay.needsWrite(self.connection_manager.connectionEpoch(relay.slave_uuid), interval):
+                    writes.append(relay)
+                else:
+                    self.relay_results[relay.uuid] = relay.getCurrentState()
+
+            pending = writes
+
+        self.relay_results.update(self.connection_manager.setRelays(pending))
+
+    def liveState(self):
+        return {
+            'readings': dict(self.readings),
+            'relays': dict(self.relay_results),
+            'manual': dict((relay.uuid, bool(relay.manual)) for relay in self.relays.iterate()),
+            'rules': dict((rule.uuid, rule.uuid in self.active_rules) for rule in self.rules.iterate()),
+            'slaves': dict((slave.uuid, bool(slave.connected)) for slave in self.slaves.iterate()),
+        }
+
+    def publishState(self):
+        """Send what changed this tick to the web workers"""
+        if self.publisher is None and self.control is None:
+            return
+
+        state = self.liveState()
+
+        if self.control is not None:
+            self.control.updateState(state)
+
+        if self.publisher is None:
+            return
+        delta = {}
+
+        for section in state:
+            if section == 'slaves' and not self.offline_online_flag:
+                continue
+
+            changed = changedKeys(self.published_state.get(section, {}), state[section])
+            if changed:
+                delta[section] = dict((key, state[section].get(key)) for key in changed)
+
+        self.published_state = state
+        self.publisher.publish(delta, state)
+
+    def flushWrites(self, force=False):
+        queue = get_write_behind()
+
+        if queue is None:
+            return
+
+        current_time = time.monotonic()
+
+        if force or current_time - self.last_flush >= self.config['GARDEN_FLUSH_INTERVAL']:
+            queue.flush()
+            self.last_flush = current_time
+
     def flagOfflineOnline(self):
         self.offline_online_flag = True
 
@@ -160,6 +535,50 @@ class Garden(object):
         for rule in self.rules.iterate():
             rule.endActivation()
 
+        for sensor in self.sensors.iterate():
+            sensor.flushAccumulator()
+
+        self.flushWrites(force=True)
+
+        if self.publisher is not None:
+            self.publisher.close()
+
+        if self.control is not None:
+            self.control.close()
+
+class DeviceWatcher(object):
+    """Track serial device nodes matching a glob, re-globbing only when their directory changes"""
+
+    def __init__(self, pattern, rescan_interval=60):
+        self.pattern = pattern
+        self.directory = os.path.dirname(pattern) or '.'
+        self.rescan_interval = rescan_interval
+        self.directory_mtime = None
+        self.last_scan = 0
+        self.devices = set()
+
+    def poll(self):
+        """Return the (added, removed) device sets since the last poll"""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        current_time = time.monotonic()
+
+        if mtime is not None and mtime == self.directory_mtime and current_time - self.last_scan < self.rescan_interval:
+            return set(), set()
+
+        self.directory_mtime = mtime
+        self.last_scan = current_time
+
+        devices = set(glob.glob(self.pattern))
+        added = devices - self.devices
+        removed = self.devices - devices
+        self.devices = devices
+
+        return added, removed
+
 class ConnectionManager(object):
 
     _commands = [["error", "s"],
@@ -168,36 +587,84 @@ class ConnectionManager(object):
             ["sensor", "siss"],
             ["sensor_response", "if"],
             ["relay", "ii"],
-            ["relay_response", "ii"]]
+            ["relay_response", "ii"],
+            ["sensor_batch", "s*"],
+            ["sensor_batch_response", "f*"]]
+
+    _probe_backoff = 5
+    _batch_miss_limit = 3
+    _stale_reply_limit = 8
     
-    def __init__(self):
+    def __init__(self, concurrent=False, batch_reads=True, device_pattern='/dev/ttyACM*', heartbeat_interval=30, read_timeout=1.0):
         self.connections = {}
         self.connections_port_to_uuid = {}
+        self.watcher = DeviceWatcher(device_pattern)
+        self.heartbeat_interval = heartbeat_interval
+        self.last_heartbeat = {}
+        self.probe_after = {}
+        self.probe_backoff = {}
+        self.batch_support = {}
+        self.batch_misses = {}
+        self.epochs = {}
+        self.batch_reads = batch_reads
+        self.read_timeout = read_timeout
+        self.concurrent = concurrent
+        self.executor = None
+        self.executor_size = 0
 
     def makeConnections(self):
-        ports_to_check = serial.tools.list_ports.grep("\/dev\/ttyACM[0-9]+")
+        added, removed = self.watcher.poll()
+
+        for device in removed:
+            self.terminateConnection(device)
+            self.last_heartbeat.pop(device, None)
 
-        for port in ports_to_check:
+        # a node that (re)appears is probed straight away
+        for device in added | removed:
+            self.probe_after.pop(device, None)
+            self.probe_backoff.pop(device, None)
 
-            device = port.device
+        current_time = time.monotonic()
+
+        for device in self.watcher.devices:
             if device in self.connections_port_to_uuid:
                 uuid = self.connections_port_to_uuid[device]
             else:
                 uuid = None
 
             if not self.isPortAssigned(device):
-                self.establishConnection(device)
+                if current_time >= self.probe_after.get(device, 0):
+                    self.probe(device)
+                    self.last_heartbeat[device] = current_time
                 continue
             
             if not self.isDeviceConnected(uuid):
                 self.terminateConnection(device)
                 continue
 
+            if current_time - self.last_heartbeat.get(device, 0) < self.heartbeat_interval:
+                continue
+
+            self.last_heartbeat[device] = current_time
+
             if not self.doesUuidMatch(uuid):
                 self.terminateConnection(device)
-                self.establishConnection(device)
+                self.probe(device)
                 continue
 
+    def probe(self, device):
+        """Try to connect a device node, backing off while it keeps failing"""
+        self.establishConnection(device)
+
+        if self.isPortAssigned(device):
+            self.probe_after.pop(device, None)
+            self.probe_backoff.pop(device, None)
+            return
+
+        delay = min(self.probe_backoff.get(device, self._probe_backoff / 2.0) * 2, self.watcher.rescan_interval)
+        self.probe_backoff[device] = delay
+        self.probe_after[device] = time.monotonic() + delay
+
     def iterate(self):
         for uuid in self.connections:
             if self.isDeviceConnected(uuid):
@@ -205,14 +672,162 @@ class ConnectionManager(object):
 
     def despawn(self):
         click.echo("Shutting down all connections")
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.executor_size = 0
+
         for device in self.connections_port_to_uuid:
             self.terminateConnection(device)
 
+    def getExecutor(self, size):
+        """One worker per slave, grown when more boards come online"""
+        if self.executor is None or self.executor_size < size:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.executor = ThreadPoolExecutor(max_workers=size)
+            self.executor_size = size
+
+        return self.executor
+
+    def runPerSlave(self, items, operation):
+        """Run operation per slave_uuid group, one board per worker, returning results keyed by item uuid"""
+        groups = {}
+        for item in items:
+            groups.setdefault(item.slave_uuid, []).append(item)
+
+        results = {}
+
+        if not self.concurrent or len(groups) < 2:
+            for slave_uuid in groups:
+                results.update(operation(slave_uuid, groups[slave_uuid]))
+            return results
+
+        executor = self.getExecutor(len(groups))
+        futures = [executor.submit(operation, slave_uuid, groups[slave_uuid]) for slave_uuid in groups]
+
+        for future in futures:
+            results.update(future.result())
+
+        return results
+
+    def readSensors(self, sensors):
+        return self.runPerSlave(sensors, self.readSensorGroup)
+
+    def readSensorGroup(self, slave_uuid, sensors):
+        batched = self.batch_reads and len(sensors) > 1 and self.batch_support.get(slave_uuid, True)
+
+        if batched:
+            results = self.readSensorBatch(slave_uuid, sensors)
+            if results is not None:
+                return results
+
+        results = {}
+        for sensor in sensors:
+            results[sensor.uuid] = self.readSensor(sensor)
+
+        # stock CmdMessenger firmware drops unknown commands without a reply,
+        # so a board that keeps missing batches but answers single reads lacks them
+        if batched and self.batch_support.get(slave_uuid, True) and any(value is not None for value in results.values()):
+            self.batch_misses[slave_uuid] = self.batch_misses.get(slave_uuid, 0) + 1
+
+            if self.batch_misses[slave_uuid] >= self._batch_miss_limit:
+                click.echo("Batch reads unanswered by %s, using single reads" % slave_uuid)
+                self.batch_support[slave_uuid] = False
+
+        return results
+
+    def readSensorBatch(self, slave_uuid, sensors):
+        """Read every sensor of one slave in one exchange, or None to fall back to single reads"""
+        if not self.isDeviceConnected(slave_uuid):
+            return dict((sensor.uuid, None) for sensor in sensors)
+
+        args = []
+        for sensor in sensors:
+            args.extend([sensor.getPinType(), str(sensor.getPin()), sensor.getDriver(), sensor.getMeasurementType()])
+
+        try:
+            c = self.connections[slave_uuid]
+
+            # the board takes one read per sensor before it answers
+            c.board.comm.reset_input_buffer()
+            c.board.comm.timeout = self.read_timeout * len(sensors)
+            try:
+                msg = self.exchange(c, slave_uuid, "sensor_batch", *args)
+            finally:
+                c.board.comm.timeout = self.read_timeout
+
+            # drop a reply that arrived just too late before the single reads go out
+            if msg is None:
+                c.board.comm.reset_input_buffer()
+        except serial.serialutil.SerialException as e:
+            return dict((sensor.uuid, None) for sensor in sensors)
+
+        if msg is not None and msg[0] == "error":
+            click.echo("Batch reads unsupported by %s, using single reads" % slave_uuid)
+            self.batch_support[slave_uuid] = False
+            return None
+
+        # a lost reply falls back for this tick; readSensorGroup decides if batching stays on
+        if msg is None:
+            return None
+
+        # a garbled reply fails this tick's reads but keeps batching on
+        if msg[0] != "sensor_batch_response" or len(msg[1]) != len(sensors):
+            return dict((sensor.uuid, None) for sensor in sensors)
+
+        self.batch_support[slave_uuid] = True
+        self.batch_misses.pop(slave_uuid, None)
+
+        results = {}
+        for sensor, value in zip(sensors, msg[1]):
+            results[sensor.uuid] = None if value != value else value
+        return results
+
+    def setRelays(self, relays):
+        return self.runPerSlave(relays, self.setRelayGroup)
+
+    def setRelayGroup(self, slave_uuid, relays):
+        results = {}
+        for relay in relays:
+            results[relay.uuid] = self.setRelay(relay)
+        return results
+
+    def exchange(self, c, slave, command, *args):
+        """Send one command and return its response, or None on timeout, recording the round trip"""
+        started = time.monotonic()
+
+        try:
+            c.send(command, *args)
+        except serial.serialutil.SerialException as e:
+            metrics.increment('garden_serial_exceptions_total', slave=slave, command=command)
+            raise
+
+        return self.receive(c, slave, command, started)
+
+    def receive(self, c, slave, command, started=None):
+        """Read one response to command, or None on timeout, recording the wait"""
+        if started is None:
+            started = time.monotonic()
+
+        try:
+            msg = c.receive()
+        except serial.serialutil.SerialException as e:
+            metrics.increment('garden_serial_exceptions_total', slave=slave, command=command)
+            raise
+
+        metrics.observe('garden_serial_roundtrip_seconds', time.monotonic() - started, slave=slave, command=command)
+
+        if msg is None:
+            metrics.increment('garden_serial_timeouts_total', slave=slave, command=command)
+
+        return msg
+
     def establishConnection(self, device):
         click.echo("Attempting to establish connection on %s" % device)
         
         try:
-            arduino = PyCmdMessenger.ArduinoBoard(device, baud_rate=115200)
+            arduino = PyCmdMessenger.ArduinoBoard(device, baud_rate=115200, timeout=self.read_timeout)
             c = PyCmdMessenger.CmdMessenger(arduino, self._commands)
         except serial.serialutil.SerialException as e:
             c = None
@@ -220,13 +835,15 @@ class ConnectionManager(object):
         if c and c.board.comm.is_open:
             
             try:
-                c.send("uuid")
-                msg = c.receive()
+                msg = self.exchange(c, device, "uuid")
             except serial.serialutil.SerialException as e:
                 click.echo("Fatal SerialException on connection")
                 return
 
-            if msg[0] == "uuid_response":
+            if msg is None:
+                c.board.close()
+                click.echo("No uuid response on %s" % device)
+            elif msg[0] == "uuid_response":
                 uuid = msg[1][0]
 
                 if len(uuid) != 36:
@@ -236,6 +853,9 @@ class ConnectionManager(object):
 
                 self.connections_port_to_uuid[device] = uuid
                 self.connections[uuid] = c
+                self.batch_support.pop(uuid, None)
+                self.batch_misses.pop(uuid, None)
+                self.epochs[uuid] = self.epochs.get(uuid, 0) + 1
                 click.echo("Succeeded for %s" % uuid)
             else:
                 c.board.close()
@@ -282,6 +902,10 @@ class ConnectionManager(object):
         self.connections[uuid] = None
         click.echo("Successfully closed.")
 
+    def connectionEpoch(self, uuid):
+        """Counter bumped every time a board (re)connects"""
+        return self.epochs.get(uuid, 0)
+
     def isPortAssigned(self, device):
         if device in self.connections_port_to_uuid and self.connections_port_to_uuid[device]:
             return True
@@ -298,12 +922,11 @@ class ConnectionManager(object):
         c = self.connections[uuid]
         
         try:
-            c.send("uuid")
-            msg = c.receive()
+            msg = self.exchange(c, uuid, "uuid")
         except serial.serialutil.SerialException as e:
             return False;
 
-        if msg[0] == "uuid_response":
+        if msg is not None and msg[0] == "uuid_response":
             return msg[1][0] == uuid
         else:
             return False
@@ -315,13 +938,18 @@ class ConnectionManager(object):
 
                 # click.echo("Reading for: %s, %s, %s, %s, %s" % (sensor.uuid, sensor.getPinType(), sensor.getPin(), sensor.getDriver(), sensor.getMeasurementType()))
 
-                c.send("sensor", sensor.getPinType(), sensor.getPin(), sensor.getDriver(), sensor.getMeasurementType())
-                msg = c.receive()
+                msg = self.exchange(c, sensor.slave_uuid, "sensor", sensor.getPinType(), sensor.getPin(), sensor.getDriver(), sensor.getMeasurementType())
+
+                # replies to earlier requests that timed out can still be queued ahead of ours
+                skipped = 0
+                while msg is not None and self.isStaleReply(msg, sensor) and skipped < self._stale_reply_limit:
+                    skipped += 1
+                    msg = self.receive(c, sensor.slave_uuid, "sensor")
             except serial.serialutil.SerialException as e:
                 # click.echo("Reading exception on: %s" % sensor.uuid)
                 return None
 
-            if msg[0] == "sensor_response":
+            if msg is not None and msg[0] == "sensor_response" and not self.isStaleReply(msg, sensor):
                 # click.echo("Recorded output: %s, %s" % (msg[1][0], msg[1][1]))
                 return msg[1][1]
             else:
@@ -330,22 +958,30 @@ class ConnectionManager(object):
         else:
             return None
 
+    def isStaleReply(self, msg, sensor):
+        if msg[0] == "sensor_batch_response":
+            return True
+
+        return msg[0] == "sensor_response" and msg[1][0] != sensor.getPin()
+
     def setRelay(self, relay):
         if self.isDeviceConnected(relay.slave_uuid):
             try:
                 c = self.connections[relay.slave_uuid]
 
-                c.send("relay", relay.getPin(), relay.getCurrentState())
-                msg = c.receive()
+                msg = self.exchange(c, relay.slave_uuid, "relay", relay.getPin(), relay.getCurrentState())
             except serial.serialutil.SerialException as e:
+                relay.forgetConfirmedState()
                 return None
 
-            if msg[0] == "relay_response":
-                relay.recordCurrentState(msg[1][1])
+            if msg is not None and msg[0] == "relay_response":
+                relay.recordCurrentState(msg[1][1], self.connectionEpoch(relay.slave_uuid))
                 return msg[1][1]
             else:
+                relay.forgetConfirmedState()
                 return None
         else:
+            relay.forgetConfirmedState()
             return None
 
 class Client(Model):
@@ -361,7 +997,39 @@ class Sensor(Model):
     _table = 'sensor'
 
     def afterInit(self):
-        self.last_reading = 0
+        self.accumulator = None
+        self.last_read_time = None
+        self.last_value = None
+        self.last_value_time = None
+
+    def getSampleInterval(self):
+        return self.getAttribute('sample_interval') or 0
+
+    def getPriority(self):
+        return self.getAttribute('priority') or 0
+
+    def isDue(self, current_time):
+        return self.last_read_time is None or current_time - self.last_read_time >= self.getSampleInterval()
+
+    def overdue(self, current_time):
+        if self.last_read_time is None:
+            return float('inf')
+
+        return current_time - self.last_read_time - self.getSampleInterval()
+
+    def recordRead(self, reading, current_time):
+        self.last_read_time = current_time
+
+        if reading is not None:
+            self.last_value = reading
+            self.last_value_time = current_time
+
+    def freshReading(self, current_time, staleness):
+        """Last good reading, or None once it is more than the staleness window past its next due read"""
+        if self.last_value_time is None or current_time - self.last_value_time > self.getSampleInterval() + staleness:
+            return None
+
+        return self.last_value
 
     def getPinType(self):
         if self.digital:
@@ -379,10 +1047,80 @@ class Sensor(Model):
         return self.measurement_type
 
     def checkAndPersistReading(self, reading, current_time):
-        if reading is not None and ((self.last_reading + 60) < current_time):
-            persisted = Measurement({'sensor_uuid': self.uuid, 'recorded_value': reading})
-            persisted.save()
-            self.last_reading = current_time
+        """Fold a reading into the current minute, persisting the previous minute once it is over"""
+        self.flushElapsedMinute(current_time)
+
+        if reading is None:
+            return
+
+        if self.accumulator is None:
+            self.accumulator = ReadingAccumulator(int(current_time // 60))
+
+        self.accumulator.add(reading)
+
+    def flushElapsedMinute(self, current_time):
+        if self.accumulator is not None and self.accumulator.minute != int(current_time // 60):
+            self.flushAccumulator()
+
+    def flushAccumulator(self):
+        accumulator = self.accumulator
+        self.accumulator = None
+
+        if accumulator is None or accumulator.count == 0:
+            return
+
+        # naive UTC, like the CURRENT_TIMESTAMP default older rows were written with
+        recorded_at = datetime.datetime.fromtimestamp(accumulator.minute * 60, datetime.timezone.utc).replace(tzinfo=None)
+
+        persisted = Measurement({
+            'sensor_uuid': self.uuid,
+            'recorded_value': accumulator.last,
+            'recorded_at': recorded_at,
+            'min_value': accumulator.minimum,
+            'max_value': accumulator.maximum,
+            'mean_value': accumulator.total / accumulator.count,
+            'sample_count': accumulator.count})
+        persisted.save()
+
+        params = {
+            'sensor_uuid': self.uuid,
+            'min_value': accumulator.minimum,
+            'max_value': accumulator.maximum,
+            'sum_value': accumulator.total,
+            'sample_count': accumulator.count,
+            'last_value': accumulator.last}
+
+        for table, bucket in (('measurement_hourly', recorded_at.replace(minute=0)), ('measurement_daily', recorded_at.replace(hour=0, minute=0))):
+            params = dict(params, bucket=bucket)
+            execute_deferred(_rollup_sql % table, params)
+
+_rollup_sql = '''INSERT INTO %s (sensor_uuid, bucket, min_value, max_value, sum_value, sample_count, last_value)
+    VALUES (:sensor_uuid, :bucket, :min_value, :max_value, :sum_value, :sample_count, :last_value)
+    ON CONFLICT (sensor_uuid, bucket) DO UPDATE SET
+        min_value = min(min_value, excluded.min_value),
+        max_value = max(max_value, excluded.max_value),
+        sum_value = sum_value + excluded.sum_value,
+        sample_count = sample_count + excluded.sample_count,
+        last_value = excluded.last_value'''
+
+class ReadingAccumulator(object):
+    """Min, max, sum, count and last value of one sensor over one minute"""
+    __slots__ = ('minute', 'minimum', 'maximum', 'total', 'count', 'last')
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.count = 0
+        self.last = None
+
+    def add(self, reading):
+        self.minimum = reading if self.minimum is None else min(self.minimum, reading)
+        self.maximum = reading if self.maximum is None else max(self.maximum, reading)
+        self.total += reading
+        self.count += 1
+        self.last = reading
 
 class Relay(Model):
     _table = 'relay'
@@ -392,7 +1130,10 @@ class Relay(Model):
         self.current_state = False
         self.forced = False
         self.last_toggle = 0
+        self.forgetConfirmedState()
+        self.current_activation = None
 
+    def terminateOpenActivations(self):
         db = get_db()
         rows = db.execute('SELECT * FROM activation WHERE relay_uuid = ? AND end_time IS NULL', (self.uuid,)).fetchall()
         activations = Collection(Activation)
@@ -401,8 +1142,6 @@ class Relay(Model):
         for activation in activations.iterate():
             activation.terminate()
 
-        self.current_activation = None
-
     def setForce(self):
         self.current_state = True
         self.forced = True
@@ -450,18 +1189,38 @@ class Relay(Model):
         else:
             return 0
 
-    def recordCurrentState(self, state):
+    def recordCurrentState(self, state, epoch=None):
         if state:
             self.current_state = True
         else:
             self.current_state = False
 
+        self.confirmed_state = self.current_state
+        self.confirmed_at = time.monotonic()
+        self.confirmed_epoch = epoch
+
+    def forgetConfirmedState(self):
+        self.confirmed_state = None
+        self.confirmed_at = 0
+        self.confirmed_epoch = None
+
+    def needsWrite(self, epoch, reassert_interval):
+        """Whether the board has to be told the desired state this tick"""
+        if self.confirmed_state is None or self.confirmed_epoch != epoch:
+            return True
+
+        if self.confirmed_state != self.current_state:
+            return True
+
+        return time.monotonic() - self.confirmed_at >= reassert_interval
+
 class Schedule(Model):
     _table = 'schedule'
 
     def appliesNow(self):
+        return self.appliesAt(datetime.datetime.now())
 
-        now = datetime.datetime.now()
+    def appliesAt(self, now):
         current = now.hour * 3600 + now.minute * 60 + now.second
 
         if self.schedule_end < self.schedule_start:
@@ -469,13 +1228,93 @@ class Schedule(Model):
         else:
             return current >= self.schedule_start and current < self.schedule_end
 
+    def nextBoundary(self, now):
+        """First start or end time strictly after now, as a local datetime"""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        candidates = []
+
+        for days in (0, 1):
+            for seconds in (self.schedule_start, self.schedule_end):
+                boundary = midnight + datetime.timedelta(days=days, seconds=seconds)
+                if boundary > now:
+                    candidates.append(boundary)
+
+        return min(candidates)
+
+class ScheduleTimeline(object):
+    """Cached schedule states, re-checked only when a schedule's next boundary passes"""
+
+    def __init__(self, clock_tolerance=2.0):
+        self.clock_tolerance = clock_tolerance
+        self.states = {}
+        self.heap = []
+        self.wall_reference = None
+        self.monotonic_reference = None
+        self.utc_offset = None
+
+    def invalidate(self):
+        self.wall_reference = None
+
+    def rebuild(self, schedules, now):
+        states = {}
+        heap = []
+
+        for schedule in schedules.iterate():
+            if schedule.active:
+                states[schedule.uuid] = schedule.appliesAt(now)
+                heapq.heappush(heap, (schedule.nextBoundary(now).timestamp(), schedule.uuid))
+            else:
+                states[schedule.uuid] = False
+
+        changed = changedKeys(self.states, states)
+        self.states = states
+        self.heap = heap
+
+        return changed
+
+    def advance(self, schedules):
+        """Bring the cached state up to date and return the schedules that flipped"""
+        wall = time.time()
+        monotonic = time.monotonic()
+        utc_offset = time.localtime(wall).tm_gmtoff
+        now = datetime.datetime.fromtimestamp(wall)
+
+        if self.wall_reference is None or utc_offset != self.utc_offset or abs(wall - self.wall_reference - (monotonic - self.monotonic_reference)) > self.clock_tolerance:
+            changed = self.rebuild(schedules, now)
+        else:
+            changed = set()
+
+            while self.heap and self.heap[0][0] <= wall:
+                boundary, uuid = heapq.heappop(self.heap)
+                schedule = schedules.fetchByUUID(uuid)
+
+                if schedule is None or not schedule.active:
+                    continue
+
+                state = schedule.appliesAt(now)
+                if self.states.get(uuid) != state:
+                    self.states[uuid] = state
+                    changed.add(uuid)
+
+                heapq.heappush(self.heap, (schedule.nextBoundary(now).timestamp(), uuid))
+
+        self.wall_reference = wall
+        self.monotonic_reference = monotonic
+        self.utc_offset = utc_offset
+
+        return changed
+
 class Rule(Model):
     _table = 'rule'
 
     def afterInit(self):
         self.element_track = {}
+        self.schedule_active = False
+        self.stable = False
+        self.last_result = None
 
-    def setChildParams(self, elements, consequences, limits):
+    def setChildParams(self, elements, consequences, limits, activations=None):
+        """Attach children and seed limit windows, from the bulk loader's activations when given"""
         self.elements = elements
         self.consequences = consequences
         self.limits = limits
@@ -484,36 +1323,90 @@ class Rule(Model):
             if element.uuid not in self.element_track:
                 self.element_track[element.uuid] = None
 
-        back_in_time = datetime.datetime.now() - datetime.timedelta(hours = 24)
+        if activations is None:
+            back_in_time = datetime.datetime.now() - datetime.timedelta(hours = 24)
 
-        db = get_db()
-        records = db.execute('SELECT * FROM activation WHERE rule_uuid = ? AND (end_time IS NULL OR end_time >= ?)', (self.uuid, back_in_time.isoformat())).fetchall()
+            db = get_db()
+            records = db.execute('SELECT * FROM activation WHERE rule_uuid = ? AND (end_time IS NULL OR end_time >= ?)', (self.uuid, back_in_time)).fetchall()
 
-        self.activations = Collection(Activation)
-        self.activations.pushRows(records)
+            activations = Collection(Activation)
+            activations.pushRows(records)
 
-        for activation in self.activations.iterate():
-            activation.terminate()
+            for activation in activations.iterate():
+                activation.terminate()
+
+        for limit in self.limits.iterate():
+            limit.loadActivations(activations)
 
         self.current_activation = None
 
+    def childUUIDs(self):
+        for children in (self.elements, self.consequences, self.limits):
+            for uuid in children.records:
+                yield uuid
+
+    def invalidate(self):
+        """Force the next tick to evaluate this rule"""
+        self.last_result = None
+
+    def refreshChildren(self, elements, consequences, limits):
+        """Swap in reloaded children, keeping hysteresis and windows of those that remain"""
+        known_limits = self.limits
+
+        self.elements = elements
+        self.consequences = consequences
+        self.limits = limits
+
+        element_track = {}
+        for element in self.elements.iterate():
+            element_track[element.uuid] = self.element_track.get(element.uuid)
+        self.element_track = element_track
+
+        new_limits = [limit for limit in self.limits.iterate() if known_limits.fetchByUUID(limit.uuid) is None]
+
+        if new_limits:
+            back_in_time = datetime.datetime.now() - datetime.timedelta(hours = 24)
+
+            db = get_db()
+            records = db.execute('SELECT * FROM activation WHERE rule_uuid = ? AND end_time IS NOT NULL AND end_time >= ?', (self.uuid, back_in_time)).fetchall()
+
+            activations = Collection(Activation)
+            activations.pushRows(records)
+
+            for limit in new_limits:
+                limit.loadActivations(activations)
+
+                if self.current_activation is not None:
+                    limit.openActivation(self.current_activation.start_time.timestamp())
+
+        self.invalidate()
+
     def endActivation(self):
         if self.current_activation is not None and self.current_activation.getAttribute('end_time') is None:
             self.current_activation.setAttribute('end_time', datetime.datetime.now())
             self.current_activation.save()
+
+            for limit in self.limits.iterate():
+                limit.closeActivation(self.current_activation.end_time.timestamp())
+
             self.current_activation = None
 
     def startActivation(self):
         if self.current_activation is None:
             self.current_activation = Activation({'rule_uuid': self.uuid, 'start_time': datetime.datetime.now(), 'end_time': None, 'last_update': datetime.datetime.now()})
             self.current_activation.save()
-            self.activations.pushExistingModel(self.current_activation)
+
+            for limit in self.limits.iterate():
+                limit.openActivation(self.current_activation.start_time.timestamp())
 
     def evaluate(self, readings, scheduler):
         can_evaluate = True if self.schedule_uuid in scheduler and scheduler[self.schedule_uuid] == True else False
 
+        self.schedule_active = can_evaluate
+
         if not can_evaluate:
             self.updateActivation(False)
+            self.settle(True, False)
             return False
 
         self.checkReadings(readings)
@@ -522,46 +1415,78 @@ class Rule(Model):
 
         if elements_passed and limits_passed:
             self.updateActivation(True)
+            self.settle(self.tracksStable(readings), True)
             return True
         else:
             self.updateActivation(False)
+            self.settle(self.tracksStable(readings), False)
             return False
 
+    def settle(self, stable, result):
+        self.stable = stable
+        self.last_result = result
+
+    def needsEvaluation(self):
+        """Whether evaluating again with unchanged readings and schedules could change the outcome"""
+        if self.last_result is None:
+            return True
+
+        if not self.schedule_active:
+            return False
+
+        return not self.stable or self.limitsActive()
+
+    def limitsActive(self):
+        for limit in self.limits.iterate():
+            if limit.isActive():
+                return True
+
+        return False
+
     def checkReadings(self, readings):
         for element in self.elements.iterate():
-            if element.sensor_uuid in readings and readings[element.sensor_uuid] is not None:
-                reading = readings[element.sensor_uuid]
-                max_value = element.max_value
-                min_value = element.min_value
-                target_value = element.target_value
-                uuid = element.uuid
-
-                in_target = False
-                triggered = False
-
-                if element.max_value is not None:
-                    in_target = reading <= max_value and reading >= target_value
-                    triggered = reading >= max_value
-                elif element.min_value is not None:
-                    in_target = reading >= min_value and reading <= target_value
-                    triggered = reading <= min_value
-                else:
-                    self.element_track[uuid] = None
-                    continue
+            self.element_track[element.uuid] = self.nextTrack(element, readings)
 
-                current_track = self.element_track[uuid]
+    def tracksStable(self, readings):
+        """Hysteresis is at a fixed point when the same readings leave every element where it is"""
+        for element in self.elements.iterate():
+            if self.nextTrack(element, readings) != self.element_track[element.uuid]:
+                return False
 
-                if current_track == 1:
-                    self.element_track[uuid] = 1 if in_target else 0
-                elif current_track == 0:
-                    self.element_track[uuid] = 1 if triggered else 0
-                elif current_track is None:
-                    self.element_track[uuid] = 1 if triggered else 0
-                else:
-                    self.element_track[uuid] = None
+        return True
+
+    def nextTrack(self, element, readings):
+        if element.sensor_uuid in readings and readings[element.sensor_uuid] is not None:
+            reading = readings[element.sensor_uuid]
+            max_value = element.max_value
+            min_value = element.min_value
+            target_value = element.target_value
+            uuid = element.uuid
+
+            in_target = False
+            triggered = False
+
+            if element.max_value is not None:
+                in_target = reading <= max_value and reading >= target_value
+                triggered = reading >= max_value
+            elif element.min_value is not None:
+                in_target = reading >= min_value and reading <= target_value
+                triggered = reading <= min_value
             else:
-                self.element_track[element.uuid] = None
-                continue
+                return None
+
+            current_track = self.element_track[uuid]
+
+            if current_track == 1:
+                return 1 if in_target else 0
+            elif current_track == 0:
+                return 1 if triggered else 0
+            elif current_track is None:
+                return 1 if triggered else 0
+            else:
+                return None
+        else:
+            return None
 
     def elementsPass(self):
         if self.elements.count() == 0:
@@ -589,8 +1514,10 @@ class Rule(Model):
         return True if track == 1 else False
 
     def limitsPass(self):
+        current_time = time.time()
+
         for limit in self.limits.iterate():
-            if limit.exceeded(self.activations):
+            if limit.exceeded(current_time):
                 return False
 
         return True
@@ -613,28 +1540,90 @@ class Consequence(Model):
 class RuleLimit(Model):
     _table = 'rule_limit'
 
-    def exceeded(self, activations):
-        every = self.every
-        period = self.period
-        count = 0
+    def afterInit(self):
+        self.window = ActivationWindow(self.every)
 
-        start = (datetime.datetime.now() - datetime.timedelta(seconds = every)).timestamp()
-        end = datetime.datetime.now().timestamp()
+    def loadActivations(self, activations):
+        ordered = sorted(activations.iterate(), key=lambda activation: activation.start_time)
 
-        for activation in activations.iterate():
-            activation_start = activation.start_time.timestamp()
-            activation_end = (activation.end_time if activation.end_time is not None else datetime.datetime.now()).timestamp()
+        for activation in ordered:
+            if activation.end_time is None:
+                self.window.open(activation.start_time.timestamp())
+            else:
+                self.window.add(activation.start_time.timestamp(), activation.end_time.timestamp())
+
+    def openActivation(self, start):
+        self.window.open(start)
+
+    def closeActivation(self, end):
+        self.window.close(end)
+
+    def isActive(self):
+        return self.window.isActive()
+
+    def exceeded(self, current_time=None):
+        if current_time is None:
+            current_time = time.time()
+
+        self.window.span = self.every
+
+        return not (self.window.total(current_time) < self.period)
+
+class ActivationWindow(object):
+    """Running total of active seconds within the trailing span seconds"""
+
+    def __init__(self, span):
+        self.span = span
+        self.closed = collections.deque()
+        self.closed_total = 0.0
+        self.open_start = None
+
+    def isActive(self):
+        """Whether the total can still change as time passes"""
+        return self.open_start is not None or len(self.closed) > 0
+
+    def open(self, start):
+        if self.open_start is None:
+            self.open_start = start
+
+    def close(self, end):
+        if self.open_start is not None:
+            self.add(self.open_start, end)
+            self.open_start = None
+
+    def add(self, start, end):
+        if end > start:
+            self.closed.append((start, end))
+            self.closed_total += end - start
+
+    def total(self, current_time):
+        window_start = current_time - self.span
+
+        while self.closed and self.closed[0][1] <= window_start:
+            start, end = self.closed.popleft()
+            self.closed_total -= end - start
+
+        if not self.closed:
+            self.closed_total = 0.0
+
+        total = self.closed_total
 
-            starting_value = max(start, activation_start)
-            ending_value = min(end, activation_end)
+        for start, end in self.closed:
+            if start >= window_start:
+                break
+            total -= min(window_start, end) - start
 
-            if ending_value > starting_value:
-                count += (ending_value - starting_value)
+        if self.open_start is not None:
+            starting_value = max(window_start, self.open_start)
+            if current_time > starting_value:
+                total += current_time - starting_value
 
-        return not (count < period)
+        return total
 
-class Activation(Model):
+class Activation(Record):
+    __slots__ = ('uuid', 'rule_uuid', 'relay_uuid', 'start_time', 'end_time', 'last_update')
     _table = 'activation'
+    _write_behind = True
 
     def preSave(self):
         self.setAttribute('last_update', datetime.datetime.now())
@@ -646,5 +1635,7 @@ class Activation(Model):
             self.setAttribute('end_time', self.getAttribute('last_update'))
         self.save()
 
-class Measurement(Model):
+class Measurement(Record):
+    __slots__ = ('uuid', 'sensor_uuid', 'recorded_value', 'recorded_at', 'min_value', 'max_value', 'mean_value', 'sample_count')
     _table = 'measurement'
+    _write_behind = True
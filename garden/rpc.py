@@ -0,0 +1,178 @@
+import json
+import os
+import queue
+import socket
+import threading
+
+class PendingCommand(object):
+    """A command waiting for the control loop to apply it on its next tick"""
+
+    def __init__(self, request):
+        self.request = request
+        self.response = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.claimed = False
+        self.cancelled = False
+
+    def claim(self):
+        """Called by the loop before applying; False if the caller gave up waiting"""
+        with self.lock:
+            if self.cancelled:
+                return False
+            self.claimed = True
+            return True
+
+    def resolve(self, response):
+        self.response = response
+        self.done.set()
+
+    def wait(self, timeout):
+        if self.done.wait(timeout):
+            return self.response
+
+        with self.lock:
+            if not self.claimed:
+                self.cancelled = True
+                return None
+
+        # the loop is applying it right now
+        self.done.wait()
+        return self.response
+
+class ControlServer(object):
+    """Unix-socket endpoint answering queries from the last tick's state and queueing commands for the next tick"""
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.commands = queue.Queue()
+        self.state = None
+        self.server = None
+
+    def open(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(16)
+
+        thread = threading.Thread(target=self.serve, name='garden-rpc', daemon=True)
+        thread.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def updateState(self, state):
+        self.state = state
+
+    def pendingCommands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+
+            if command.claim():
+                yield command
+
+    def serve(self):
+        server = self.server
+
+        while True:
+            try:
+                client, address = server.accept()
+            except OSError:
+                return
+
+            thread = threading.Thread(target=self.handle, args=(client,), daemon=True)
+            thread.start()
+
+    def handle(self, client):
+        with client:
+            reader = client.makefile('rb')
+
+            for line in reader:
+                try:
+                    request = json.loads(line.decode('utf8'))
+                except ValueError:
+                    response = {'ok': False, 'error': 'Malformed request.'}
+                else:
+                    # a request that trips up the handler still gets a reply
+                    try:
+                        response = self.answer(request)
+                    except Exception:
+                        response = {'ok': False, 'error': 'Request failed.'}
+
+                try:
+                    client.sendall((json.dumps(response) + '\n').encode('utf8'))
+                except OSError:
+                    return
+
+    def answer(self, request):
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'Malformed request.'}
+
+        if 'query' in request:
+            return self.query(request)
+
+        if 'command' in request:
+            command = PendingCommand(request)
+            self.commands.put(command)
+            response = command.wait(self.timeout)
+
+            if response is None:
+                return {'ok': False, 'error': 'Timed out waiting for the control loop.'}
+
+            return response
+
+        return {'ok': False, 'error': 'Expected a query or a command.'}
+
+    def query(self, request):
+        if not isinstance(request['query'], str):
+            return {'ok': False, 'error': 'query must be a string.'}
+
+        state = self.state
+
+        if state is None:
+            return {'ok': False, 'error': 'No state published yet.'}
+
+        if request['query'] == 'state':
+            return {'ok': True, 'state': state}
+
+        if request['query'] in state:
+            return {'ok': True, 'state': {request['query']: state[request['query']]}}
+
+        return {'ok': False, 'error': 'Unknown query.'}
+
+def call(path, request, timeout=5):
+    """Send one request to the control loop and return its reply, or None if it is unreachable"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+
+    try:
+        client.connect(path)
+        client.sendall((json.dumps(request) + '\n').encode('utf8'))
+
+        buffered = b''
+        while b'\n' not in buffered:
+            chunk = client.recv(65536)
+            if not chunk:
+                return None
+            buffered += chunk
+    except OSError:
+        return None
+    finally:
+        client.close()
+
+    return json.loads(buffered.split(b'\n', 1)[0].decode('utf8'))
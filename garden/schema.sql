@@ -9,6 +9,8 @@ DROP TABLE IF EXISTS consequence;
 DROP TABLE IF EXISTS rule_limit;
 DROP TABLE IF EXISTS activation;
 DROP TABLE IF EXISTS measurement;
+DROP TABLE IF EXISTS measurement_hourly;
+DROP TABLE IF EXISTS measurement_daily;
 
 CREATE TABLE client (
   uuid VARCHAR(36) PRIMARY KEY,
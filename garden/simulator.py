@@ -0,0 +1,368 @@
+import math
+import os
+import pty
+import random
+import select
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import tty
+import uuid
+
+import click
+
+from garden.metrics import metrics
+from garden.model import ConnectionManager, Garden
+
+_field_separator = b','
+_command_separator = b';'
+_escape = b'/'
+_escaped = (b',', b';', b'/', b'\0')
+
+_command_index = dict((command[0], index) for index, command in enumerate(ConnectionManager._commands))
+_command_name = dict((index, command[0]) for index, command in enumerate(ConnectionManager._commands))
+
+def escape(value):
+    output = bytearray()
+
+    for byte in value:
+        if bytes((byte,)) in _escaped:
+            output += _escape
+        output.append(byte)
+
+    return bytes(output)
+
+def pack(format, value):
+    """Encode one field the way PyCmdMessenger does for a 2 byte int, 4 byte float board"""
+    if format == 'i':
+        return struct.pack('<h', int(value))
+    if format == 'f':
+        return struct.pack('<f', value)
+    return str(value).encode('ascii')
+
+def unpack(format, value):
+    if format == 'i':
+        return struct.unpack('<h', value)[0]
+    if format == 'f':
+        return struct.unpack('<f', value)[0]
+    return value.decode('ascii').strip('\0')
+
+def encode(command, formats, values):
+    fields = [str(_command_index[command]).encode('ascii')]
+
+    for format, value in zip(formats, values):
+        fields.append(escape(pack(format, value)))
+
+    return _field_separator.join(fields) + _command_separator
+
+class Framer(object):
+    """Split an incoming byte stream into commands of raw, unescaped fields"""
+
+    def __init__(self):
+        self.fields = [bytearray()]
+        self.escaped = False
+
+    def feed(self, data):
+        commands = []
+
+        for byte in data:
+            byte = bytes((byte,))
+
+            if self.escaped:
+                self.fields[-1] += byte
+                self.escaped = False
+            elif byte == _escape:
+                self.escaped = True
+            elif byte == _field_separator:
+                self.fields.append(bytearray())
+            elif byte == _command_separator:
+                commands.append([bytes(field) for field in self.fields])
+                self.fields = [bytearray()]
+            else:
+                self.fields[-1] += byte
+
+        return commands
+
+class VirtualBoard(object):
+    """A simulated slave answering the ConnectionManager protocol on a pseudo-terminal symlinked at link"""
+
+    def __init__(self, link, board_uuid=None, latency=0.0, jitter=0.0, drop_rate=0.0, batch=True, batch_latency=0.0, seed=None):
+        self.link = link
+        self.uuid = board_uuid or str(uuid.uuid4())
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.batch = batch
+        self.batch_latency = batch_latency
+        self.random = random.Random(seed)
+        self.relays = {}
+        self.writes = []
+        self.master = None
+        self.slave = None
+        self.thread = None
+        self.running = False
+        self.requests = 0
+        self.dropped = 0
+
+    def isPlugged(self):
+        return self.running
+
+    def plug(self):
+        if self.running:
+            return
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.symlink(os.ttyname(self.slave), self.link)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name='virtual-board', daemon=True)
+        self.thread.start()
+
+    def unplug(self):
+        if not self.running:
+            return
+
+        self.running = False
+
+        try:
+            os.unlink(self.link)
+        except OSError:
+            pass
+
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def serve(self):
+        framer = Framer()
+
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+
+            if not ready:
+                continue
+
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+
+            for fields in framer.feed(data):
+                self.respond(fields)
+
+    def respond(self, fields):
+        self.requests += 1
+
+        try:
+            command = _command_name[int(fields[0].decode('ascii'))]
+            reply = self.answer(command, fields[1:])
+        except (ValueError, KeyError, UnicodeDecodeError, struct.error):
+            reply = ('error', 's', ['malformed command'])
+
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if reply[0] == 'sensor_batch_response':
+            delay += self.batch_latency
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            os.write(self.master, encode(*reply))
+        except OSError:
+            pass
+
+    def answer(self, command, fields):
+        if command == 'uuid':
+            return ('uuid_response', 's', [self.uuid])
+
+        if command == 'sensor':
+            pin = unpack('i', fields[1])
+            return ('sensor_response', 'if', [pin, self.reading(unpack('s', fields[0]), pin)])
+
+        if command == 'relay':
+            pin = unpack('i', fields[0])
+            self.relays[pin] = unpack('i', fields[1])
+            self.writes.append((pin, self.relays[pin]))
+            return ('relay_response', 'ii', [pin, self.relays[pin]])
+
+        if command == 'sensor_batch' and self.batch:
+            values = []
+            for index in range(0, len(fields) - 3, 4):
+                values.append(self.reading(unpack('s', fields[index]), int(unpack('s', fields[index + 1]))))
+            return ('sensor_batch_response', 'f' * len(values), values)
+
+        return ('error', 's', ['unknown command'])
+
+    def reading(self, pin_type, pin):
+        """A slow wave around 20, offset per pin so sensors differ"""
+        return 20.0 + 5.0 * math.sin(time.time() / 60.0 + pin)
+
+class SimulatedGarden(Garden):
+    """Garden that keeps every stage duration for the simulation report"""
+
+    def __init__(self):
+        super(SimulatedGarden, self).__init__()
+        self.stage_times = {}
+
+    def recordStage(self, stage, elapsed):
+        self.stage_times.setdefault(stage, []).append(elapsed)
+        super(SimulatedGarden, self).recordStage(stage, elapsed)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Simulation(object):
+    """Run the control loop against virtual boards in a throwaway instance"""
+
+    def __init__(self, boards=2, sensors=4, relays=4, latency=0.005, jitter=0.002, drop_rate=0.0, unplug_every=0, batch=True, concurrent=False, seed=None):
+        self.board_count = boards
+        self.sensor_count = sensors
+        self.relay_count = relays
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.unplug_every = unplug_every
+        self.batch = batch
+        self.concurrent = concurrent
+        self.seed = seed
+        self.boards = []
+
+    def createApp(self, directory):
+        from garden import create_app
+
+        return create_app({
+            'SECRET_KEY': 'simulation',
+            'DATABASE': os.path.join(directory, 'garden.sqlite'),
+            'GARDEN_DEVICE_PATTERN': os.path.join(directory, 'ttySIM*'),
+            'GARDEN_CONCURRENT_IO': self.concurrent,
+            'GARDEN_BATCH_SENSOR_READS': True,
+            'GARDEN_TICK_REPORT_EVERY': 0,
+            'GARDEN_LIVE_SOCKET': None,
+            'GARDEN_RPC_SOCKET': None,
+            'GARDEN_METRICS_FILE': os.path.join(directory, 'metrics.prom'),
+            'GARDEN_AUTH_REVOCATIONS': os.path.join(directory, 'revocations.json'),
+        })
+
+    def seedDatabase(self):
+        from garden.model import Consequence, Element, Relay, Rule, Schedule, Sensor, Slave
+
+        schedule = Schedule({'nickname': 'always', 'schedule_start': 0, 'schedule_end': 86399, 'active': 1})
+        schedule.save()
+
+        for board in self.boards:
+            Slave({'uuid': board.uuid, 'nickname': os.path.basename(board.link), 'connected': 0}).save()
+
+            sensors = []
+            for pin in range(self.sensor_count):
+                sensor = Sensor({'slave_uuid': board.uuid, 'digital': 0, 'driver': 'simulated', 'pin': pin, 'measurement_type': 'temperature'})
+                sensor.save()
+                sensors.append(sensor)
+
+            relays = []
+            for pin in range(self.relay_count):
+                relay = Relay({'slave_uuid': board.uuid, 'relay_type': 'simulated', 'pin': 20 + pin})
+                relay.save()
+                relays.append(relay)
+
+            if sensors and relays:
+                rule = Rule({'schedule_uuid': schedule.uuid, 'logic_type': 'and'})
+                rule.save()
+                Element({'rule_uuid': rule.uuid, 'sensor_uuid': sensors[0].uuid, 'max_value': 22, 'target_value': 20, 'min_value': None}).save()
+                Consequence({'rule_uuid': rule.uuid, 'relay_uuid': relays[0].uuid}).save()
+
+    def plugBoards(self, directory):
+        rng = random.Random(self.seed)
+
+        for index in range(self.board_count):
+            board = VirtualBoard(
+                    os.path.join(directory, 'ttySIM%d' % index),
+                    board_uuid=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    latency=self.latency,
+                    jitter=self.jitter,
+                    drop_rate=self.drop_rate,
+                    batch=self.batch,
+                    seed=rng.random())
+            board.plug()
+            self.boards.append(board)
+
+    def run(self, ticks):
+        from garden.db import init_db
+
+        directory = tempfile.mkdtemp(prefix='garden-simulation-')
+
+        try:
+            app = self.createApp(directory)
+
+            with app.app_context():
+                init_db()
+                self.plugBoards(directory)
+                self.seedDatabase()
+
+                garden = SimulatedGarden()
+                garden.setIterator()
+
+                connect_started = time.monotonic()
+                garden.makeConnections()
+                click.echo("Connected %d of %d boards in %.2fs" % (len(list(garden.connection_manager.iterate())), len(self.boards), time.monotonic() - connect_started))
+
+                garden.stage_times = {}
+                durations = []
+                replug = {}
+
+                for tick in range(ticks):
+                    for board in [board for board in replug if replug[board] == tick]:
+                        board.plug()
+                        del replug[board]
+
+                    if self.unplug_every and tick and tick % self.unplug_every == 0:
+                        board = self.boards[(tick // self.unplug_every) % len(self.boards)]
+                        board.unplug()
+                        replug[board] = tick + 1
+
+                    started = time.monotonic()
+                    garden.tickLoop()
+                    durations.append(time.monotonic() - started)
+
+                garden.close()
+                self.report(garden, durations)
+                return garden
+        finally:
+            for board in self.boards:
+                board.unplug()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, garden, durations):
+        if not durations:
+            return
+
+        click.echo("Ticks: %d, mean: %.4fs, p50: %.4fs, p95: %.4fs, max: %.4fs" % (
+            len(durations), sum(durations) / len(durations), percentile(durations, 0.5), percentile(durations, 0.95), max(durations)))
+
+        for stage in garden._stages:
+            times = garden.stage_times.get(stage)
+            if times:
+                click.echo("  %-22s mean %.4fs  max %.4fs" % (stage, sum(times) / len(times), max(times)))
+
+        with metrics.lock:
+            roundtrips = dict(metrics.histograms.get('garden_serial_roundtrip_seconds', {}))
+            timeouts = dict(metrics.counters.get('garden_serial_timeouts_total', {}))
+
+        commands = {}
+        for labels in roundtrips:
+            command = dict(labels)['command']
+            count, total = commands.get(command, (0, 0.0))
+            commands[command] = (count + roundtrips[labels].count, total + roundtrips[labels].sum)
+
+        for command in sorted(commands):
+            count, total = commands[command]
+            click.echo("  serial %-15s %6d exchanges, mean %.4fs" % (command, count, total / max(count, 1)))
+
+        click.echo("  serial timeouts: %d, replies dropped by boards: %d, requests: %d" % (
+            sum(timeouts.values()), sum(board.dropped for board in self.boards), sum(board.requests for board in self.boards)))
@@ -0,0 +1,72 @@
+import click
+import time
+
+class TickScheduler(object):
+    """Deadline-based pacing for the control loop on a fixed monotonic grid"""
+
+    def __init__(self, period, budgets=None, report_every=60):
+        self.period = period
+        self.budgets = budgets or {}
+        self.report_every = report_every
+        self.resetStats()
+        self.next_deadline = None
+        self.tick_start = None
+
+    def resetStats(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+        self.max_duration = 0.0
+        self.stage_overruns = {}
+
+    def waitForDeadline(self):
+        """Sleep until the next deadline and return how late the tick starts"""
+        now = time.monotonic()
+
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        delay = self.next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            now = time.monotonic()
+
+        jitter = now - self.next_deadline
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_jitter += jitter
+        self.tick_start = now
+
+        return jitter
+
+    def recordStage(self, stage, elapsed):
+        budget = self.budgets.get(stage)
+
+        if budget is not None and elapsed > budget:
+            self.stage_overruns[stage] = self.stage_overruns.get(stage, 0) + 1
+
+    def completeTick(self):
+        now = time.monotonic()
+
+        self.ticks += 1
+        self.max_duration = max(self.max_duration, now - self.tick_start)
+        self.next_deadline += self.period
+
+        if now > self.next_deadline:
+            self.overruns += 1
+            missed = int((now - self.next_deadline) // self.period)
+            self.skipped += missed
+            self.next_deadline += missed * self.period
+
+        if self.report_every and self.ticks >= self.report_every:
+            self.report()
+
+    def report(self):
+        click.echo("Ticks: %d, overruns: %d, skipped deadlines: %d, mean jitter: %.4fs, max jitter: %.4fs, max tick: %.4fs" % (
+            self.ticks, self.overruns, self.skipped, self.total_jitter / max(self.ticks, 1), self.max_jitter, self.max_duration))
+
+        for stage in sorted(self.stage_overruns):
+            click.echo("Stage %s over budget %d times" % (stage, self.stage_overruns[stage]))
+
+        self.resetStats()
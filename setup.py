@@ -1,12 +1,12 @@
 from setuptools import find_packages, setup
 
 setup(
-    name='garden'
-    version='1.0.0'
-    packages=find_packages()
-    include_package_date=True
+    name='garden',
+    version='1.0.0',
+    packages=find_packages(),
+    include_package_data=True,
     zip_safe=False,
     install_requires=[
         'flask',
-    ]
+    ],
 )
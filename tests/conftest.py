@@ -0,0 +1,125 @@
+import datetime
+import time
+import types
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from garden import create_app
+from garden.db import get_db, init_db
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'garden.sqlite'),
+        'GARDEN_LIVE_SOCKET': None,
+        'GARDEN_RPC_SOCKET': None,
+        'GARDEN_METRICS_FILE': str(tmp_path / 'metrics.prom'),
+        'GARDEN_AUTH_REVOCATIONS': str(tmp_path / 'revocations.json'),
+    })
+
+    with app.app_context():
+        init_db()
+
+    yield app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
+
+class AuthActions(object):
+    def __init__(self, app, client):
+        self.app = app
+        self.client = client
+
+    def create(self, identifier='ident', secret='secret', nickname='tester', active=1):
+        with self.app.app_context():
+            db = get_db()
+            db.execute(
+                'INSERT INTO client (uuid, identifier, secret, active, nickname) VALUES (?, ?, ?, ?, ?)',
+                (identifier + '-uuid', identifier, generate_password_hash(secret), active, nickname))
+            db.commit()
+
+    def login(self, identifier='ident', secret='secret'):
+        return self.client.post('/auth/login', data={'identifier': identifier, 'secret': secret})
+
+@pytest.fixture
+def auth(app, client):
+    return AuthActions(app, client)
+
+class FakeConnections(object):
+    """Stands in for ConnectionManager, answering reads from a dict of values"""
+
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.reads = []
+        self.writes = []
+
+    def readSensors(self, sensors):
+        self.reads.append([sensor.uuid for sensor in sensors])
+        return dict((sensor.uuid, self.values.get(sensor.uuid)) for sensor in sensors)
+
+    def setRelays(self, relays):
+        self.writes.append([relay.uuid for relay in relays])
+        return dict((relay.uuid, relay.getCurrentState()) for relay in relays)
+
+    def connectionEpoch(self, uuid):
+        return 1
+
+    def iterate(self):
+        return iter(())
+
+    def despawn(self):
+        pass
+
+@pytest.fixture
+def connections():
+    return FakeConnections()
+
+class FakeClock(object):
+    """Replaces time and datetime.now inside garden.model; wall and monotonic time move together"""
+
+    def __init__(self, wall=1700000000.0):
+        self.wall = wall
+        self.offset = 1000.0 - wall
+
+    def advance(self, seconds):
+        self.wall += seconds
+
+    def jump(self, seconds):
+        """Step the wall clock only, like an NTP correction"""
+        self.wall += seconds
+        self.offset -= seconds
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.wall + self.offset
+
+    def localtime(self, seconds=None):
+        return time.localtime(self.wall if seconds is None else seconds)
+
+class FakeDatetime(object):
+    """Stands in for datetime.datetime with now() following the clock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def now(self, tz=None):
+        return datetime.datetime.fromtimestamp(self.clock.wall, tz)
+
+    def __getattr__(self, name):
+        return getattr(datetime.datetime, name)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('garden.model.time', clock)
+    monkeypatch.setattr('garden.model.datetime', types.SimpleNamespace(**dict(vars(datetime), datetime=FakeDatetime(clock))))
+    return clock
@@ -0,0 +1,74 @@
+import types
+
+import pytest
+from flask import g
+
+from garden import auth
+from garden.auth import AttemptLimiter, HashingBusy, offload_hashing
+
+def test_attempts_expire_with_window(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(auth, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    limiter = AttemptLimiter()
+
+    assert [limiter.allow('ident', 2, 60) for attempt in range(3)] == [True, True, False]
+    assert limiter.allow('other', 2, 60)
+
+    clock.now = 59.0
+    assert not limiter.allow('ident', 2, 60)
+
+    clock.now = 60.5
+    assert limiter.allow('ident', 2, 60)
+
+def test_login_rate_limited(app, client, auth, monkeypatch):
+    monkeypatch.setitem(app.config, 'GARDEN_LOGIN_ATTEMPTS', 2)
+    auth.create(identifier='limited')
+
+    assert auth.login(identifier='limited', secret='wrong').status_code == 400
+    assert auth.login(identifier='limited', secret='wrong').status_code == 400
+
+    response = auth.login(identifier='limited')
+    assert response.status_code == 429
+    assert not response.get_json()['authenticated']
+
+def test_register_rate_limited(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'GARDEN_REGISTER_ATTEMPTS', 1)
+
+    first = client.post('/auth/register', data={'nickname': 'one'}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    second = client.post('/auth/register', data={'nickname': 'two'}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+
+def test_hashing_busy_when_slots_taken(app, monkeypatch):
+    monkeypatch.setitem(auth._hashing, 'slots', None)
+    monkeypatch.setitem(app.config, 'GARDEN_HASH_CONCURRENCY', 1)
+    monkeypatch.setitem(app.config, 'GARDEN_HASH_WAIT', 0.01)
+
+    with app.app_context():
+        slots = auth.hash_slots()
+        assert offload_hashing(str.upper, 'secret') == 'SECRET'
+
+        slots.acquire()
+        try:
+            with pytest.raises(HashingBusy):
+                offload_hashing(str.upper, 'secret')
+        finally:
+            slots.release()
+
+def test_client_same_shape_from_claims_and_database(app, client, auth):
+    auth.create()
+    auth.login()
+
+    expected = {'uuid': 'ident-uuid', 'nickname': 'tester', 'active': True}
+
+    with client:
+        client.get('/control/state')
+        assert g.client == expected
+
+        # expired claims are re-signed from the database row
+        with client.session_transaction() as session:
+            session['claims_expire'] = 0
+
+        client.get('/control/state')
+        assert g.client == expected
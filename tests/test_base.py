@@ -0,0 +1,199 @@
+import datetime
+
+from garden.base import Collection, enable_write_behind, execute_deferred
+from garden.db import get_db
+from garden.model import Activation, Element, Garden, Measurement, Slave, _rollup_sql
+
+def rule_uuids(collection, rule_uuid):
+    return sorted(element.uuid for element in collection.findBy('rule_uuid', rule_uuid))
+
+def test_index_follows_attribute_changes():
+    elements = Collection(Element, ('rule_uuid',))
+    first = elements.addNewRecord({'rule_uuid': 'r1'})
+    second = elements.addNewRecord({'rule_uuid': 'r2'})
+
+    first.setAttribute('rule_uuid', 'r2')
+
+    assert rule_uuids(elements, 'r1') == []
+    assert rule_uuids(elements, 'r2') == sorted([first.uuid, second.uuid])
+
+def test_removed_record_leaves_index():
+    elements = Collection(Element, ('rule_uuid',))
+    element = elements.addNewRecord({'rule_uuid': 'r1'})
+
+    elements.removeByUUID(element.uuid)
+    element.setAttribute('rule_uuid', 'r2')
+
+    assert elements.indexes == {'rule_uuid': {}}
+    assert element._observers == []
+
+def test_indexed_and_scanned_lookups_agree():
+    indexed = Collection(Element, ('rule_uuid',))
+    scanned = Collection(Element)
+
+    for rule_uuid in ('r1', 'r2', 'r1', None):
+        element = indexed.addNewRecord({'rule_uuid': rule_uuid})
+        scanned.pushExistingModel(element)
+
+    for rule_uuid in ('r1', 'r2', None, 'missing'):
+        assert rule_uuids(indexed, rule_uuid) == rule_uuids(scanned, rule_uuid)
+
+    indexed_groups = dict((key, group.count()) for key, group in indexed.groupBy('rule_uuid').items())
+    scanned_groups = dict((key, group.count()) for key, group in scanned.groupBy('rule_uuid').items())
+    assert indexed_groups == scanned_groups == {'r1': 2, 'r2': 1, None: 1}
+
+def measurement_count():
+    return get_db().execute('SELECT COUNT(*) FROM measurement').fetchone()[0]
+
+def test_deferred_save_waits_for_flush(app):
+    with app.app_context():
+        queue = enable_write_behind()
+        Measurement({'sensor_uuid': 's', 'recorded_value': 1.0}).save()
+
+        assert measurement_count() == 0
+        assert queue.flush() == 1
+        assert measurement_count() == 1
+
+def test_repeated_saves_collapse(app):
+    with app.app_context():
+        queue = enable_write_behind()
+        measurement = Measurement({'sensor_uuid': 's', 'recorded_value': 1.0})
+        measurement.save()
+        measurement.setAttribute('recorded_value', 2.0)
+        measurement.save()
+
+        assert queue.count() == 1
+
+        statements = []
+        get_db().set_trace_callback(statements.append)
+        queue.flush()
+        get_db().set_trace_callback(None)
+
+        assert len([sql for sql in statements if sql.startswith('INSERT')]) == 1
+        assert get_db().execute('SELECT recorded_value FROM measurement').fetchone()[0] == 2.0
+
+def test_statements_with_same_sql_keep_push_order(app):
+    with app.app_context():
+        queue = enable_write_behind()
+
+        for value in (1.0, 5.0, 3.0):
+            execute_deferred(_rollup_sql % 'measurement_hourly', {
+                'sensor_uuid': 's', 'bucket': '2023-01-01 05:00:00', 'min_value': value, 'max_value': value,
+                'sum_value': value, 'sample_count': 1, 'last_value': value})
+
+        assert get_db().execute('SELECT COUNT(*) FROM measurement_hourly').fetchone()[0] == 0
+        queue.flush()
+
+        row = get_db().execute('SELECT min_value, max_value, sample_count, last_value FROM measurement_hourly').fetchone()
+        assert tuple(row) == (1.0, 5.0, 3, 3.0)
+
+def test_close_flushes_queue(app, connections):
+    with app.app_context():
+        garden = Garden()
+        garden.connection_manager = connections
+        enable_write_behind()
+
+        Measurement({'sensor_uuid': 's', 'recorded_value': 1.0}).save()
+        assert measurement_count() == 0
+
+        garden.close()
+        assert measurement_count() == 1
+
+def traced_save(model):
+    statements = []
+    get_db().set_trace_callback(statements.append)
+    model.save()
+    get_db().set_trace_callback(None)
+    return [sql for sql in statements if sql.startswith(('INSERT', 'UPDATE'))]
+
+def test_update_sets_only_changed_columns(app):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 0})
+        slave.save()
+
+        slave = Slave.recordsByUUID().fetchByUUID(slave.uuid)
+        slave.set('connected', 1)
+
+        statements = traced_save(slave)
+
+        # preSave stamps last_seen on every write
+        assert len(statements) == 1
+        assert statements[0].startswith('UPDATE slave SET connected=1, last_seen=')
+        assert 'nickname' not in statements[0]
+
+def test_unchanged_save_issues_no_statement(app):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 0})
+        slave.save()
+
+        assert traced_save(slave) == []
+
+        slave = Slave.recordsByUUID().fetchByUUID(slave.uuid)
+        slave.set('connected', 0)
+
+        assert traced_save(slave) == []
+
+def test_failing_row_does_not_block_later_flushes(app):
+    with app.app_context():
+        queue = enable_write_behind()
+
+        Measurement({'sensor_uuid': 's', 'recorded_value': 1.0}).save()
+        execute_deferred('INSERT INTO slave (uuid, connected) VALUES (:uuid, NULL)', {'uuid': 'broken'})
+        queue.flush()
+
+        # the good row from the failed batch still lands, the bad one is dropped
+        assert measurement_count() == 1
+        assert queue.count() == 0
+        assert get_db().execute('SELECT COUNT(*) FROM slave').fetchone()[0] == 0
+
+        Measurement({'sensor_uuid': 's', 'recorded_value': 2.0}).save()
+        queue.flush()
+
+        assert measurement_count() == 2
+
+def test_record_rows_load_into_slots(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO measurement (uuid, sensor_uuid, recorded_value, recorded_at) VALUES ('m', 's', 1.5, '2023-01-01 05:00:00')")
+
+        measurement, = Measurement.fromRows(db.execute('SELECT * FROM measurement').fetchall())
+
+    assert not hasattr(measurement, '__dict__')
+    assert (measurement.uuid, measurement.sensor_uuid, measurement.recorded_value) == ('m', 's', 1.5)
+    assert measurement.recorded_at == datetime.datetime(2023, 1, 1, 5)
+    assert not measurement.isDirty()
+
+def test_record_insert_leaves_defaults_to_the_table(app):
+    with app.app_context():
+        measurement = Measurement({'sensor_uuid': 's', 'recorded_value': 1.0})
+        assert not measurement.hasAttribute('recorded_at')
+
+        statements = traced_save(measurement)
+        assert 'recorded_at' not in statements[0]
+
+        measurement.refresh()
+        assert isinstance(measurement.recorded_at, datetime.datetime)
+
+        activation = Activation({'rule_uuid': 'r', 'end_time': None})
+        statements = traced_save(activation)
+        assert 'start_time' not in statements[0]
+
+        activation.refresh()
+        assert isinstance(activation.start_time, datetime.datetime)
+
+def test_record_update_writes_dirty_columns(app):
+    with app.app_context():
+        Measurement({'sensor_uuid': 's', 'recorded_value': 1.0}).save()
+        Activation({'rule_uuid': 'r', 'end_time': None}).save()
+
+        measurement = Measurement.fromRow(get_db().execute('SELECT * FROM measurement').fetchone())
+        measurement.setAttribute('recorded_value', 2.0)
+        assert traced_save(measurement) == ["UPDATE measurement SET recorded_value=2.0 WHERE uuid='%s'" % measurement.uuid]
+
+        activation = Activation.fromRow(get_db().execute('SELECT * FROM activation').fetchone())
+        activation.setAttribute('end_time', datetime.datetime(2023, 1, 1, 5))
+        statement, = traced_save(activation)
+
+        # preSave stamps last_update
+        assert statement.startswith("UPDATE activation SET end_time='2023-01-01 05:00:00', last_update=")
+        assert 'rule_uuid' not in statement and 'start_time' not in statement
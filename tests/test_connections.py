@@ -0,0 +1,206 @@
+import threading
+import types
+
+from garden.metrics import Metrics
+from garden.model import ConnectionManager, Sensor
+from garden.simulator import VirtualBoard
+
+class FakeMessenger(object):
+    """Replays canned replies in place of a CmdMessenger on a serial port"""
+
+    def __init__(self, replies):
+        self.board = types.SimpleNamespace(comm=types.SimpleNamespace(is_open=True, timeout=1.0, reset_input_buffer=lambda: None))
+        self.replies = list(replies)
+        self.sent = []
+        self.args = []
+
+    def send(self, command, *args):
+        self.sent.append(command)
+        self.args.append(args)
+
+    def receive(self):
+        return self.replies.pop(0) if self.replies else None
+
+def make_manager(replies):
+    manager = ConnectionManager(batch_reads=True)
+    messenger = FakeMessenger(replies)
+    manager.connections['board'] = messenger
+    return manager, messenger
+
+def make_sensors(count):
+    return [Sensor({'slave_uuid': 'board', 'digital': 0, 'driver': 'd', 'measurement_type': 'm', 'pin': pin}) for pin in range(count)]
+
+def test_batch_read():
+    manager, messenger = make_manager([('sensor_batch_response', [1.0, float('nan')], 0)])
+    sensors = make_sensors(2)
+
+    results = manager.readSensors(sensors)
+
+    assert results == {sensors[0].uuid: 1.0, sensors[1].uuid: None}
+    assert manager.batch_support['board']
+
+def test_batch_timeout_keeps_batching():
+    manager, messenger = make_manager([
+        None,
+        ('sensor_response', [0, 1.0], 0),
+        ('sensor_response', [1, 2.0], 0),
+        ('sensor_batch_response', [3.0, 4.0], 0)])
+    sensors = make_sensors(2)
+
+    assert manager.readSensors(sensors) == {sensors[0].uuid: 1.0, sensors[1].uuid: 2.0}
+    assert manager.batch_support.get('board', True)
+
+    assert manager.readSensors(sensors) == {sensors[0].uuid: 3.0, sensors[1].uuid: 4.0}
+    assert messenger.sent == ['sensor_batch', 'sensor', 'sensor', 'sensor_batch']
+    assert 'board' not in manager.batch_misses
+
+def test_silent_board_falls_back_to_single_reads():
+    class SilentMessenger(FakeMessenger):
+        """A board without a default handler: batch requests go unanswered"""
+        def receive(self):
+            if self.sent[-1] == 'sensor_batch':
+                return None
+            return ('sensor_response', [self.args[-1][1], 1.0], 0)
+
+    manager = ConnectionManager(batch_reads=True)
+    messenger = SilentMessenger([])
+    manager.connections['board'] = messenger
+    sensors = make_sensors(2)
+
+    for tick in range(ConnectionManager._batch_miss_limit):
+        assert manager.readSensors(sensors) == {sensors[0].uuid: 1.0, sensors[1].uuid: 1.0}
+
+    assert manager.batch_support['board'] is False
+
+    messenger.sent = []
+    manager.readSensors(sensors)
+    assert messenger.sent == ['sensor', 'sensor']
+
+def test_unresponsive_board_keeps_batching():
+    manager, messenger = make_manager([])
+    sensors = make_sensors(2)
+
+    for tick in range(ConnectionManager._batch_miss_limit + 1):
+        assert manager.readSensors(sensors) == dict((sensor.uuid, None) for sensor in sensors)
+
+    assert manager.batch_support.get('board', True)
+
+def test_batch_error_falls_back_to_single_reads():
+    manager, messenger = make_manager([
+        ('error', ['unknown command'], 0),
+        ('sensor_response', [0, 1.0], 0),
+        ('sensor_response', [1, 2.0], 0)])
+    sensors = make_sensors(2)
+
+    assert manager.readSensors(sensors) == {sensors[0].uuid: 1.0, sensors[1].uuid: 2.0}
+    assert manager.batch_support['board'] is False
+    assert messenger.sent == ['sensor_batch', 'sensor', 'sensor']
+
+def test_mismatched_pin_reply_skipped():
+    manager, messenger = make_manager([
+        None,
+        ('sensor_batch_response', [5.0, 6.0], 0),
+        ('sensor_response', [0, 1.0], 0),
+        ('sensor_response', [1, 2.0], 0)])
+    sensors = make_sensors(2)
+
+    assert manager.readSensors(sensors) == {sensors[0].uuid: 1.0, sensors[1].uuid: 2.0}
+
+def test_skipped_replies_recorded_in_metrics(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr('garden.model.metrics', registry)
+
+    manager, messenger = make_manager([('sensor_response', [1, 2.0], 0), None])
+    sensor = make_sensors(1)[0]
+
+    assert manager.readSensor(sensor) is None
+
+    labels = (('command', 'sensor'), ('slave', 'board'))
+    assert registry.histograms['garden_serial_roundtrip_seconds'][labels].count == 2
+    assert registry.counters['garden_serial_timeouts_total'][labels] == 1
+
+def test_slow_batch_keeps_replies_aligned(tmp_path):
+    class NumberedBoard(VirtualBoard):
+        def reading(self, pin_type, pin):
+            return 100.0 + pin
+
+    # the batch answers after its scaled timeout, ahead of the first single read's reply
+    board = NumberedBoard(str(tmp_path / 'ttySIM0'), batch_latency=0.7)
+    board.plug()
+    manager = ConnectionManager(batch_reads=True, device_pattern=str(tmp_path / 'ttySIM*'), read_timeout=0.2)
+
+    try:
+        manager.makeConnections()
+        sensors = [Sensor({'slave_uuid': board.uuid, 'digital': 0, 'driver': 'd', 'measurement_type': 'm', 'pin': pin}) for pin in range(3)]
+
+        for tick in range(3):
+            results = manager.readSensors(sensors)
+            assert [results[sensor.uuid] for sensor in sensors] == [100.0, 101.0, 102.0]
+    finally:
+        manager.despawn()
+        board.unplug()
+
+def test_slaves_read_concurrently():
+    # each board only answers once the other is waiting too
+    barrier = threading.Barrier(2, timeout=5)
+
+    class WaitingMessenger(FakeMessenger):
+        def receive(self):
+            barrier.wait()
+            return ('sensor_response', [self.args[-1][1], float(self.args[-1][1])], 0)
+
+    manager = ConnectionManager(concurrent=True, batch_reads=False)
+    sensors = []
+    for slave_uuid in ('first', 'second'):
+        manager.connections[slave_uuid] = WaitingMessenger([])
+        for pin in range(2):
+            sensors.append(Sensor({'slave_uuid': slave_uuid, 'digital': 0, 'driver': 'd', 'measurement_type': 'm', 'pin': pin}))
+
+    try:
+        results = manager.readSensors(sensors)
+    finally:
+        manager.despawn()
+
+    assert results == dict((sensor.uuid, float(sensor.pin)) for sensor in sensors)
+    assert [args[1] for args in manager.connections['first'].args] == [0, 1]
+
+def test_failed_probe_backs_off(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('garden.model.time.monotonic', lambda: clock[0])
+
+    (tmp_path / 'ttyACM0').write_text('')
+    manager = ConnectionManager(device_pattern=str(tmp_path / 'ttyACM*'))
+    probes = []
+    monkeypatch.setattr(manager, 'establishConnection', probes.append)
+
+    manager.makeConnections()
+    assert len(probes) == 1
+
+    for elapsed in (1, 2, 4.9):
+        clock[0] = 1000.0 + elapsed
+        manager.makeConnections()
+    assert len(probes) == 1
+
+    clock[0] = 1005.0
+    manager.makeConnections()
+    assert len(probes) == 2
+
+    clock[0] = 1014.0
+    manager.makeConnections()
+    assert len(probes) == 2
+
+    clock[0] = 1015.0
+    manager.makeConnections()
+    assert len(probes) == 3
+
+def test_new_device_probed_at_once(tmp_path, monkeypatch):
+    (tmp_path / 'ttyACM0').write_text('')
+    manager = ConnectionManager(device_pattern=str(tmp_path / 'ttyACM*'))
+    probes = []
+    monkeypatch.setattr(manager, 'establishConnection', probes.append)
+
+    manager.makeConnections()
+    (tmp_path / 'ttyACM1').write_text('')
+    manager.makeConnections()
+
+    assert sorted(probes) == sorted([str(tmp_path / 'ttyACM0'), str(tmp_path / 'ttyACM1')])
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from garden import control
+from garden.model import Garden, Relay, Slave
+from garden.rpc import ControlServer, PendingCommand, call
+
+@pytest.fixture
+def garden(app, tmp_path):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        Relay({'slave_uuid': slave.uuid, 'relay_type': 't', 'pin': 2}).save()
+
+        garden = Garden()
+        garden.control = ControlServer(str(tmp_path / 'control.sock'), timeout=2)
+        garden.control.open()
+        yield garden
+        garden.control.close()
+
+def run_command(garden, request):
+    replies = []
+    caller = threading.Thread(target=lambda: replies.append(call(garden.control.path, request)))
+    caller.start()
+
+    while garden.control.commands.empty():
+        caller.join(0.01)
+
+    garden.applyCommands()
+    caller.join()
+    return replies[0]
+
+def test_set_manual_applies_on_next_tick(garden):
+    relay = next(garden.relays.iterate())
+
+    reply = run_command(garden, {'command': 'setManual', 'relay_uuid': relay.uuid, 'manual': True})
+
+    assert reply == {'ok': True, 'relay_uuid': relay.uuid, 'manual': True}
+    garden.calculateForcedRelays()
+    assert relay.isForced()
+
+def test_failing_command_still_answered(garden, monkeypatch):
+    def fail(request):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(garden, 'applyCommand', fail)
+
+    replies = []
+    caller = threading.Thread(target=lambda: replies.append(call(garden.control.path, {'command': 'setManual'})))
+    caller.start()
+
+    while garden.control.commands.empty():
+        caller.join(0.01)
+
+    garden.applyCommands()
+
+    caller.join(5)
+    assert not caller.is_alive()
+    assert replies == [{'ok': False, 'error': 'Command failed.'}]
+
+    # the loop carries on with the next tick
+    garden.calculateForcedRelays()
+
+def test_malformed_relay_uuid_rejected(garden):
+    reply = run_command(garden, {'command': 'setManual', 'relay_uuid': ['x'], 'manual': True})
+
+    assert reply == {'ok': False, 'error': 'relay_uuid must be a string.'}
+
+def test_unclaimed_command_cancelled():
+    command = PendingCommand({'command': 'setManual'})
+
+    assert command.wait(0.01) is None
+    assert not command.claim()
+
+def test_call_runs_in_thread_pool_under_eventlet(app, monkeypatch):
+    executed = []
+
+    class FakePool(object):
+        @staticmethod
+        def execute(function, *args):
+            executed.append(function)
+            return {'ok': True}
+
+    monkeypatch.setattr(control, 'green', lambda: True)
+    monkeypatch.setattr(control, 'tpool', FakePool)
+    monkeypatch.setitem(app.config, 'GARDEN_RPC_SOCKET', 'control.sock')
+
+    with app.app_context():
+        assert control.call_garden({'query': 'state'}) == ({'ok': True}, 200)
+
+    assert executed == [call]
+
+def test_control_unavailable_without_socket(client, auth):
+    auth.create()
+    auth.login()
+
+    response = client.get('/control/state')
+
+    assert response.status_code == 503
+    assert response.get_json() == {'ok': False, 'error': 'The control loop is not running.'}
+
+def test_unhashable_query_answered(garden):
+    garden.control.updateState({'relays': {}})
+
+    assert call(garden.control.path, {'query': ['relays']}) == {'ok': False, 'error': 'query must be a string.'}
+    assert call(garden.control.path, {'query': 'relays'}) == {'ok': True, 'state': {'relays': {}}}
+
+def test_failing_handler_still_replies(garden, monkeypatch):
+    def fail(request):
+        raise TypeError('boom')
+    monkeypatch.setattr(garden.control, 'query', fail)
+
+    assert call(garden.control.path, {'query': 'relays'}, timeout=2) == {'ok': False, 'error': 'Request failed.'}
@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from garden.db import ConnectionPool, get_db, get_pool, get_read_db, list_migrations, migrate_db
+
+def test_checked_in_connection_reused(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'), size=1)
+
+    first = pool.checkout()
+    first.execute('CREATE TABLE item (value)')
+    first.execute('INSERT INTO item VALUES (1)')
+    assert first.in_transaction
+    pool.checkin(first)
+
+    # the open transaction was rolled back on checkin
+    assert pool.checkout() is first
+    assert first.execute('SELECT COUNT(*) FROM item').fetchone()[0] == 0
+
+    second = pool.checkout()
+    assert second is not first
+
+    pool.checkin(first)
+    pool.checkin(second)
+    assert pool.idle == [first]
+    pool.close()
+
+def test_forked_pool_drops_inherited_connections(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'))
+    inherited = pool.checkout()
+    pool.checkin(inherited)
+
+    # as seen from a child process after fork
+    pool.pid = -1
+
+    assert pool.checkout() is not inherited
+    assert pool.idle == []
+
+def test_read_pool_refuses_writes(app):
+    with app.app_context():
+        connection = get_pool('read').checkout()
+
+        assert connection.execute('SELECT COUNT(*) FROM client').fetchone()[0] == 0
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("INSERT INTO client (uuid, identifier, secret, active, nickname) VALUES ('u', 'i', 's', 1, 'n')")
+
+        get_pool('read').checkin(connection)
+
+def index_columns(db, table):
+    indexes = {}
+
+    for index in db.execute('PRAGMA index_list(%s)' % table).fetchall():
+        indexes[index['name']] = [column['name'] for column in db.execute('PRAGMA index_info(%s)' % index['name']).fetchall()]
+
+    return indexes
+
+def test_migrations_ship_hot_query_indexes(app):
+    with app.app_context():
+        db = get_db()
+
+        assert index_columns(db, 'activation')['activation_rule_end'] == ['rule_uuid', 'end_time']
+        assert index_columns(db, 'activation')['activation_relay_end'] == ['relay_uuid', 'end_time']
+        assert index_columns(db, 'measurement')['measurement_sensor_recorded_at'] == ['sensor_uuid', 'recorded_at']
+
+def test_migrating_twice_is_a_no_op(app):
+    with app.app_context():
+        db = get_db()
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        indexes = index_columns(db, 'activation')
+
+        assert version == list_migrations()[-1][0]
+        assert migrate_db() == []
+        assert db.execute('PRAGMA user_version').fetchone()[0] == version
+        assert index_columns(db, 'activation') == indexes
+
+def test_pool_pragmas(app):
+    with app.app_context():
+        writer = get_db()
+        reader = get_read_db()
+
+        assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert writer.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert writer.execute('PRAGMA query_only').fetchone()[0] == 0
+        assert reader.execute('PRAGMA query_only').fetchone()[0] == 1
+
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("UPDATE slave SET nickname = 'x'")
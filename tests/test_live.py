@@ -0,0 +1,157 @@
+import json
+import socket
+
+from garden import socketio
+from garden.live import LiveHub, LivePublisher, hub
+from garden.model import Garden, Relay, Slave
+
+def test_connect_requires_login(app):
+    live = socketio.test_client(app)
+    assert not live.is_connected()
+
+def test_connect_sends_snapshot(app, client, auth):
+    auth.create()
+    assert auth.login().status_code == 200
+
+    live = socketio.test_client(app, flask_test_client=client)
+    assert live.is_connected()
+    assert live.get_received()[0]['name'] == 'snapshot'
+
+def test_connect_rejected_after_deactivation(app, client, auth, runner):
+    auth.create()
+    auth.login()
+
+    runner.invoke(args=['deactivate-client', 'tester'])
+
+    live = socketio.test_client(app, flask_test_client=client)
+    assert not live.is_connected()
+
+def test_subscribe_ignores_bad_interval(app, client, auth):
+    auth.create()
+    auth.login()
+
+    known = set(hub.clients)
+    live = socketio.test_client(app, flask_test_client=client)
+    sid, = set(hub.clients) - known
+
+    for interval in ('soon', [1], None, 'nan', 'inf'):
+        live.emit('subscribe', {'interval': interval})
+    assert live.is_connected()
+    assert hub.clients[sid]['interval'] == hub.min_interval
+
+    live.emit('subscribe', {'interval': 30})
+    assert hub.clients[sid]['interval'] == 30
+
+def read_messages_raw(subscriber):
+    """Every byte the publisher has sent so far"""
+    buffered = b''
+    subscriber.settimeout(0.2)
+
+    try:
+        while True:
+            chunk = subscriber.recv(65536)
+            if not chunk:
+                break
+            buffered += chunk
+    except socket.timeout:
+        pass
+
+    return buffered
+
+def read_messages(subscriber):
+    return [json.loads(line.decode('utf8')) for line in read_messages_raw(subscriber).splitlines()]
+
+def test_publisher_sends_changes_and_hub_coalesces(app, tmp_path, monkeypatch):
+    path = str(tmp_path / 'live.sock')
+
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        relay = Relay({'slave_uuid': slave.uuid, 'relay_type': 'r', 'pin': 2})
+        relay.save()
+
+        garden = Garden()
+        garden.publisher = LivePublisher(path)
+        garden.publisher.open()
+
+        subscriber = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        subscriber.connect(path)
+
+        try:
+            ticks = [
+                ({'a': 1.0, 'b': 2.0}, {relay.uuid: 0}),
+                ({'a': 1.0, 'b': 2.0}, {relay.uuid: 0}),
+                ({'a': 1.5, 'b': 2.0}, {relay.uuid: 0}),
+                ({'a': 1.5, 'b': 2.5}, {relay.uuid: 1}),
+            ]
+
+            for readings, relays in ticks:
+                garden.resetOfflineOnline()
+                garden.readings = readings
+                garden.relay_results = relays
+                garden.publishState()
+
+            messages = read_messages(subscriber)
+        finally:
+            subscriber.close()
+            garden.publisher.close()
+
+    # the snapshot goes out on connect, the unchanged tick sends nothing
+    assert [message['type'] for message in messages] == ['snapshot', 'delta', 'delta', 'delta']
+    assert messages[0]['data']['readings'] == {'a': 1.0, 'b': 2.0}
+    assert messages[2]['data'] == {'readings': {'a': 1.5}}
+    assert messages[3]['data'] == {'readings': {'b': 2.5}, 'relays': {relay.uuid: 1}}
+
+    live = LiveHub()
+    live.addClient('sid')
+    emitted = []
+    monkeypatch.setattr(socketio, 'emit', lambda event, data, room: emitted.append((room, data)))
+
+    for message in messages:
+        live.apply(message)
+
+    # a burst inside the client's interval is held back
+    live.emitPending()
+    assert emitted == []
+
+    live.clients['sid']['last_emit'] -= live.min_interval
+    live.emitPending()
+    assert emitted == [('sid', {
+        'readings': {'a': 1.5, 'b': 2.5},
+        'relays': {relay.uuid: 1},
+        'manual': {relay.uuid: False},
+        'rules': {},
+        'slaves': {slave.uuid: True}})]
+
+def test_snapshot_larger_than_socket_buffer_arrives_whole(tmp_path):
+    publisher = LivePublisher(str(tmp_path / 'live.sock'))
+    publisher.open()
+    subscriber = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    subscriber.connect(publisher.path)
+    subscriber.settimeout(0.05)
+
+    snapshot = {'readings': dict(('sensor-%d' % index, float(index)) for index in range(100000))}
+    buffered = b''
+
+    try:
+        publisher.publish({}, snapshot)
+        assert publisher.subscribers[0]['outgoing']
+
+        # the rest goes out on later ticks as the reader catches up
+        for tick in range(1000):
+            try:
+                buffered += subscriber.recv(1 << 20)
+            except socket.timeout:
+                pass
+            publisher.publish({}, snapshot)
+            if not publisher.subscribers[0]['outgoing']:
+                break
+
+        publisher.publish({'readings': {'sensor-1': 2.0}}, snapshot)
+        buffered += read_messages_raw(subscriber)
+    finally:
+        subscriber.close()
+        publisher.close()
+
+    messages = [json.loads(line.decode('utf8')) for line in buffered.splitlines()]
+    assert messages == [{'type': 'snapshot', 'data': snapshot}, {'type': 'delta', 'data': {'readings': {'sensor-1': 2.0}}}]
@@ -0,0 +1,134 @@
+import datetime
+import json
+
+from flask import current_app
+
+from garden.db import get_db, migrate_db
+from garden.model import Sensor
+
+def legacy_database(app):
+    """A database at migration 0001, before readings were rolled up"""
+    with app.app_context():
+        db = get_db()
+
+        with current_app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf8'))
+        with current_app.open_resource('migrations/0001_hot_query_indexes.sql') as f:
+            db.executescript(f.read().decode('utf8'))
+
+        db.execute('PRAGMA user_version = 1')
+        return db
+
+def test_migration_backfills_rollups(app):
+    db = legacy_database(app)
+
+    with app.app_context():
+        for uuid, value, recorded_at in (('a', 1.0, '2023-01-01 05:10:00'), ('b', 3.0, '2023-01-01 05:50:00'), ('c', 8.0, '2023-01-01 07:00:00')):
+            db.execute("INSERT INTO measurement (uuid, sensor_uuid, recorded_value, recorded_at) VALUES (?, 's', ?, ?)", (uuid, value, recorded_at))
+        db.commit()
+
+        migrate_db()
+
+        hourly = [tuple(row) for row in db.execute('SELECT bucket, min_value, max_value, sum_value, sample_count, last_value FROM measurement_hourly ORDER BY bucket')]
+        daily = [tuple(row) for row in db.execute('SELECT bucket, min_value, max_value, sum_value, sample_count, last_value FROM measurement_daily')]
+
+    assert hourly == [
+        (datetime.datetime(2023, 1, 1, 5), 1, 3, 4, 2, 3),
+        (datetime.datetime(2023, 1, 1, 7), 8, 8, 8, 1, 8)]
+    assert daily == [(datetime.datetime(2023, 1, 1), 1, 8, 12, 3, 8)]
+
+def test_long_range_query_returns_backfilled_data(app, client, auth):
+    db = legacy_database(app)
+
+    with app.app_context():
+        db.execute("INSERT INTO measurement (uuid, sensor_uuid, recorded_value, recorded_at) VALUES ('a', 's', 2.0, '2023-01-10 12:00:00')")
+        db.commit()
+        migrate_db()
+
+    auth.create()
+    auth.login()
+
+    response = client.get('/data/sensors/s/measurements?start=2023-01-01T00:00:00&end=2023-02-01T00:00:00&points=500')
+    rows = [json.loads(line) for line in response.data.decode('utf8').splitlines()]
+
+    assert [row['sample_count'] for row in rows] == [1]
+
+def test_minute_rows_recorded_in_utc(app):
+    with app.app_context():
+        sensor = Sensor({'slave_uuid': 'board', 'driver': 'd', 'measurement_type': 'm', 'pin': 1})
+        minute = int(datetime.datetime(2023, 1, 1, 5, 30, tzinfo=datetime.timezone.utc).timestamp())
+        sensor.checkAndPersistReading(4.0, minute)
+        sensor.flushAccumulator()
+
+        row = get_db().execute('SELECT recorded_at FROM measurement').fetchone()
+        bucket = get_db().execute('SELECT bucket FROM measurement_hourly').fetchone()
+
+    assert row['recorded_at'] == datetime.datetime(2023, 1, 1, 5, 30)
+    assert bucket['bucket'] == datetime.datetime(2023, 1, 1, 5)
+
+def query_rows(client, start, end, points):
+    response = client.get('/data/sensors/s/measurements?start=%s&end=%s&points=%d' % (start, end, points))
+    return [json.loads(line) for line in response.data.decode('utf8').splitlines()]
+
+def test_buckets_aligned_to_start(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        for minute in range(17):
+            recorded_at = datetime.datetime(2023, 1, 1, 5, 0, 30) + datetime.timedelta(minutes=minute)
+            db.execute(
+                "INSERT INTO measurement (uuid, sensor_uuid, recorded_value, recorded_at, min_value, max_value, mean_value, sample_count) VALUES (?, 's', ?, ?, ?, ?, ?, ?)",
+                (str(minute), minute, recorded_at, minute - 1, minute + 1, minute, 1 + minute % 2))
+        db.commit()
+
+    auth.create()
+    auth.login()
+
+    # 1000s over 3 points is a width of 334s; epoch-aligned buckets would give 4 rows
+    rows = query_rows(client, '2023-01-01T05:00:30', '2023-01-01T05:17:10', 3)
+
+    assert [row['time'] for row in rows] == ['2023-01-01T05:00:30', '2023-01-01T05:06:04', '2023-01-01T05:11:38']
+    assert [row['sample_count'] for row in rows] == [9, 9, 7]
+    assert [row['min_value'] for row in rows] == [-1, 5, 11]
+    assert [row['max_value'] for row in rows] == [6, 12, 17]
+
+    # minute means weighted by their sample counts
+    assert rows[0]['mean_value'] == sum(minute * (1 + minute % 2) for minute in range(6)) / 9
+
+def test_source_table_follows_bucket_width(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO measurement (uuid, sensor_uuid, recorded_value, recorded_at, mean_value, sample_count) VALUES ('m', 's', 1.0, '2023-01-01 05:00:00', 1.0, 3)")
+        for table, count in (('measurement_hourly', 5), ('measurement_daily', 7)):
+            db.execute(
+                "INSERT INTO %s (sensor_uuid, bucket, min_value, max_value, sum_value, sample_count, last_value) VALUES ('s', '2023-01-01 00:00:00', 1, 2, ?, ?, 2)" % table,
+                (count * 1.5, count))
+        db.commit()
+
+    auth.create()
+    auth.login()
+
+    def source(points):
+        rows = query_rows(client, '2023-01-01T00:00:00', '2023-01-03T00:00:00', points)
+        return [(row['sample_count'], row['mean_value']) for row in rows]
+
+    # a day wide reads the daily rollup, an hour wide the hourly one, anything finer the minute rows
+    assert source(2) == [(7, 1.5)]
+    assert source(48) == [(5, 1.5)]
+    assert source(2880) == [(3, 1.0)]
+
+def test_rollup_includes_bucket_holding_start(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        for hour, count in ((5, 1), (6, 2), (7, 4)):
+            db.execute(
+                "INSERT INTO measurement_hourly (sensor_uuid, bucket, min_value, max_value, sum_value, sample_count, last_value) VALUES ('s', ?, 1, 1, ?, ?, 1)",
+                (datetime.datetime(2023, 1, 1, hour), count, count))
+        db.commit()
+
+    auth.create()
+    auth.login()
+
+    rows = query_rows(client, '2023-01-01T05:30:00', '2023-01-01T07:30:00', 2)
+
+    assert [row['time'] for row in rows] == ['2023-01-01T05:30:00', '2023-01-01T06:30:00']
+    assert [row['sample_count'] for row in rows] == [3, 4]
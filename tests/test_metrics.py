@@ -0,0 +1,51 @@
+from garden.metrics import Histogram, Metrics
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.render('tick_seconds', (('stage', 'checkRules'),)) == [
+        'tick_seconds_bucket{stage="checkRules",le="0.1"} 2',
+        'tick_seconds_bucket{stage="checkRules",le="1.0"} 3',
+        'tick_seconds_bucket{stage="checkRules",le="+Inf"} 4',
+        'tick_seconds_sum{stage="checkRules"} 2.65',
+        'tick_seconds_count{stage="checkRules"} 4']
+
+def test_render_escapes_labels_and_sorts_series():
+    registry = Metrics()
+    registry.describe('timeouts_total', 'Requests without a response.')
+
+    registry.increment('timeouts_total', slave='b', command='sensor')
+    registry.increment('timeouts_total', slave='a "quoted" \\ slave', command='sensor')
+    registry.increment('timeouts_total', 2, slave='b', command='sensor')
+
+    assert registry.render() == '\n'.join([
+        '# HELP timeouts_total Requests without a response.',
+        '# TYPE timeouts_total counter',
+        'timeouts_total{command="sensor",slave="a \\"quoted\\" \\\\ slave"} 1',
+        'timeouts_total{command="sensor",slave="b"} 3']) + '\n'
+
+def test_render_histogram_without_labels():
+    registry = Metrics()
+    registry.observe('tick_seconds', 0.003)
+
+    lines = registry.render().splitlines()
+
+    assert lines[0] == '# TYPE tick_seconds histogram'
+    assert 'tick_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'tick_seconds_bucket{le="0.005"} 1' in lines
+    assert lines[-1] == 'tick_seconds_count 1'
+
+def test_endpoint_unavailable_until_published(app, client):
+    response = client.get('/metrics')
+    assert response.status_code == 503
+
+    registry = Metrics()
+    registry.increment('ticks_total')
+    registry.writeFile(app.config['GARDEN_METRICS_FILE'])
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.data.decode('utf8') == '# TYPE ticks_total counter\nticks_total 1\n'
@@ -0,0 +1,47 @@
+import pytest
+
+from garden.model import Garden, Relay, Slave
+from garden.simulator import VirtualBoard
+
+@pytest.fixture
+def board(tmp_path):
+    board = VirtualBoard(str(tmp_path / 'ttySIM0'))
+    board.plug()
+    yield board
+    board.unplug()
+
+def test_relay_written_only_on_change_reassert_and_reconnect(app, board, clock, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'GARDEN_DEVICE_PATTERN', str(tmp_path / 'ttySIM*'))
+    interval = app.config['GARDEN_RELAY_REASSERT_INTERVAL']
+
+    with app.app_context():
+        Slave({'uuid': board.uuid, 'nickname': 'board', 'connected': 0}).save()
+        relay = Relay({'slave_uuid': board.uuid, 'relay_type': 'r', 'pin': 20, 'manual': 1})
+        relay.save()
+
+        garden = Garden()
+        garden.setIterator()
+
+        try:
+            garden.tickLoop()
+            assert board.writes == [(20, 1)]
+
+            # the confirmed state matches the desired one
+            clock.advance(interval / 2)
+            garden.tickLoop()
+            assert board.writes == [(20, 1)]
+
+            clock.advance(interval / 2)
+            garden.tickLoop()
+            assert board.writes == [(20, 1), (20, 1)]
+
+            board.unplug()
+            garden.tickLoop()
+            board.plug()
+            garden.tickLoop()
+
+            # a board that reconnects may have reset its pins
+            assert board.writes == [(20, 1), (20, 1), (20, 1)]
+            assert garden.relay_results[relay.uuid] == 1
+        finally:
+            garden.close()
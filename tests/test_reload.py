@@ -0,0 +1,125 @@
+import sqlite3
+
+from garden.db import get_db
+from garden.model import Consequence, Element, Garden, Relay, Rule, Schedule, Sensor, Slave
+
+def test_reload_keeps_unchanged_objects(app):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        schedule = Schedule({'nickname': 'always', 'schedule_start': 0, 'schedule_end': 86399, 'active': 1})
+        schedule.save()
+
+        sensors = []
+        for pin in range(2):
+            sensor = Sensor({'slave_uuid': slave.uuid, 'driver': 'd', 'measurement_type': 'm', 'pin': pin})
+            sensor.save()
+            sensors.append(sensor)
+
+        relays = []
+        for pin in range(2):
+            relay = Relay({'slave_uuid': slave.uuid, 'relay_type': 'r', 'pin': 20 + pin})
+            relay.save()
+            relays.append(relay)
+
+        kept = Rule({'schedule_uuid': schedule.uuid, 'logic_type': 'and'})
+        kept.save()
+        staying = Element({'rule_uuid': kept.uuid, 'sensor_uuid': sensors[0].uuid, 'max_value': 25, 'target_value': 20, 'min_value': None})
+        staying.save()
+        dropped = Element({'rule_uuid': kept.uuid, 'sensor_uuid': sensors[1].uuid, 'max_value': 25, 'target_value': 20, 'min_value': None})
+        dropped.save()
+        Consequence({'rule_uuid': kept.uuid, 'relay_uuid': relays[0].uuid}).save()
+
+        removed = Rule({'schedule_uuid': schedule.uuid, 'logic_type': 'and'})
+        removed.save()
+        Consequence({'rule_uuid': removed.uuid, 'relay_uuid': relays[1].uuid}).save()
+
+        garden = Garden()
+
+        sensor = garden.sensors.fetchByUUID(sensors[0].uuid)
+        relay = garden.relays.fetchByUUID(relays[0].uuid)
+        relay.current_state = True
+        relay.last_toggle = 1234.0
+
+        rule = garden.rules.fetchByUUID(kept.uuid)
+        rule.element_track = {staying.uuid: 1, dropped.uuid: 0}
+
+        garden.rules.fetchByUUID(removed.uuid).startActivation()
+        garden.active_rules.add(removed.uuid)
+        garden.relays.fetchByUUID(relays[1].uuid).setForce()
+
+        # edits arrive from another process, as the web app makes them
+        other = sqlite3.connect(app.config['DATABASE'])
+        other.execute('UPDATE sensor SET pin = 7 WHERE uuid = ?', (sensors[0].uuid,))
+        other.execute("INSERT INTO rule_limit (uuid, rule_uuid, period, every) VALUES ('limit-uuid', ?, 600, 3600)", (kept.uuid,))
+        other.execute('DELETE FROM element WHERE uuid = ?', (dropped.uuid,))
+        other.execute('DELETE FROM consequence WHERE rule_uuid = ?', (removed.uuid,))
+        other.execute('DELETE FROM rule WHERE uuid = ?', (removed.uuid,))
+        other.execute('DELETE FROM relay WHERE uuid = ?', (relays[1].uuid,))
+        other.commit()
+        other.close()
+
+        garden.reloadConfig()
+
+        assert garden.sensors.fetchByUUID(sensors[0].uuid) is sensor
+        assert sensor.pin == 7
+
+        assert garden.relays.fetchByUUID(relays[0].uuid) is relay
+        assert relay.current_state is True
+        assert relay.last_toggle == 1234.0
+
+        assert garden.rules.fetchByUUID(kept.uuid) is rule
+        assert rule.element_track == {staying.uuid: 1}
+        assert [limit.uuid for limit in rule.limits.iterate()] == ['limit-uuid']
+        assert kept.uuid in garden.unsettled_rules
+
+        assert garden.rules.fetchByUUID(removed.uuid) is None
+        assert garden.relays.fetchByUUID(relays[1].uuid) is None
+        assert removed.uuid not in garden.active_rules
+        assert removed.uuid not in garden.rules_by_schedule[schedule.uuid]
+
+        open_activations = get_db().execute(
+            'SELECT COUNT(*) FROM activation WHERE (rule_uuid = ? OR relay_uuid = ?) AND end_time IS NULL', (removed.uuid, relays[1].uuid)
+        ).fetchone()[0]
+        started = get_db().execute(
+            'SELECT COUNT(*) FROM activation WHERE rule_uuid = ? OR relay_uuid = ?', (removed.uuid, relays[1].uuid)
+        ).fetchone()[0]
+        assert started == 2
+        assert open_activations == 0
+
+def test_reload_skipped_without_outside_commits(app, monkeypatch):
+    with app.app_context():
+        garden = Garden()
+        reloads = []
+        monkeypatch.setattr(garden, 'applyConfigChanges', lambda: reloads.append(True))
+
+        Slave({'nickname': 'board', 'connected': 0}).save()
+        garden.reloadConfig()
+
+        assert reloads == []
+
+def test_reload_rewrites_moved_relay(app):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        moved = Relay({'slave_uuid': slave.uuid, 'relay_type': 'r', 'pin': 20})
+        moved.save()
+        renamed = Relay({'slave_uuid': slave.uuid, 'relay_type': 'r', 'pin': 21})
+        renamed.save()
+
+        garden = Garden()
+
+        for relay in garden.relays.iterate():
+            relay.recordCurrentState(1, epoch=1)
+            assert not relay.needsWrite(1, 3600)
+
+        other = sqlite3.connect(app.config['DATABASE'])
+        other.execute('UPDATE relay SET pin = 8 WHERE uuid = ?', (moved.uuid,))
+        other.execute("UPDATE relay SET relay_type = 'pump' WHERE uuid = ?", (renamed.uuid,))
+        other.commit()
+        other.close()
+
+        garden.reloadConfig()
+
+        assert garden.relays.fetchByUUID(moved.uuid).needsWrite(1, 3600)
+        assert not garden.relays.fetchByUUID(renamed.uuid).needsWrite(1, 3600)
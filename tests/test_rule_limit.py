@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from garden.model import ActivationWindow
+
+def overlap_total(intervals, open_start, current_time, span):
+    """The pre-window RuleLimit.exceeded loop: overlap of every activation with the trailing span"""
+    start = current_time - span
+    total = 0.0
+
+    if open_start is not None:
+        intervals = intervals + [(open_start, current_time)]
+
+    for activation_start, activation_end in intervals:
+        starting_value = max(start, activation_start)
+        ending_value = min(current_time, activation_end)
+
+        if ending_value > starting_value:
+            total += ending_value - starting_value
+
+    return total
+
+@pytest.mark.parametrize('seed', range(20))
+def test_window_matches_overlap_loop(seed):
+    rng = random.Random(seed)
+    span = rng.choice([60, 600, 3600])
+    window = ActivationWindow(span)
+
+    current_time = 1700000000.0
+    intervals = []
+    open_start = None
+
+    for step in range(500):
+        current_time += rng.expovariate(1 / 30.0)
+
+        if open_start is None and rng.random() < 0.3:
+            open_start = current_time
+            window.open(current_time)
+        elif open_start is not None and rng.random() < 0.3:
+            intervals.append((open_start, current_time))
+            window.close(current_time)
+            open_start = None
+
+        expected = overlap_total(intervals, open_start, current_time, span)
+        assert window.total(current_time) == pytest.approx(expected, abs=1e-6)
+
+def test_loaded_history_matches_overlap_loop():
+    window = ActivationWindow(100)
+    for start, end in ((0, 30), (40, 60), (90, 150)):
+        window.add(start, end)
+    window.open(170)
+
+    # loaded history always ends before the first query
+    for current_time in (150, 175, 200, 300):
+        assert window.total(current_time) == pytest.approx(overlap_total([(0, 30), (40, 60), (90, 150)], 170, current_time, 100))
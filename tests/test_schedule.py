@@ -0,0 +1,56 @@
+import datetime
+import random
+
+import pytest
+
+from garden.base import Collection
+from garden.model import Schedule, ScheduleTimeline
+
+def expected_states(schedules, wall):
+    """What checking appliesAt for every schedule on every tick gives"""
+    now = datetime.datetime.fromtimestamp(wall)
+    return dict((schedule.uuid, bool(schedule.active and schedule.appliesAt(now))) for schedule in schedules.iterate())
+
+@pytest.mark.parametrize('seed', range(5))
+def test_timeline_matches_per_tick_check(clock, seed):
+    rng = random.Random(seed)
+    schedules = Collection(Schedule)
+
+    for index in range(20):
+        schedules.addNewRecord({
+            'nickname': 'schedule %d' % index,
+            'schedule_start': rng.randrange(86400),
+            'schedule_end': rng.randrange(86400),
+            'active': rng.random() < 0.8})
+
+    timeline = ScheduleTimeline()
+    previous = {}
+
+    for step in range(5000):
+        clock.advance(rng.uniform(0, 60))
+
+        # occasional wall clock corrections, forwards and backwards
+        if rng.random() < 0.002:
+            clock.jump(rng.uniform(-5000, 5000))
+
+        changed = timeline.advance(schedules)
+        expected = expected_states(schedules, clock.time())
+
+        assert timeline.states == expected
+        assert changed == set(uuid for uuid in expected if previous.get(uuid) != expected[uuid])
+        previous = expected
+
+def test_timeline_follows_schedule_edits(clock):
+    schedules = Collection(Schedule)
+    schedule = schedules.addNewRecord({'nickname': 'day', 'schedule_start': 0, 'schedule_end': 86399, 'active': 1})
+    timeline = ScheduleTimeline()
+
+    timeline.advance(schedules)
+    assert timeline.states[schedule.uuid]
+
+    schedule.setAttribute('active', 0)
+    timeline.invalidate()
+    clock.advance(1)
+
+    assert timeline.advance(schedules) == set([schedule.uuid])
+    assert not timeline.states[schedule.uuid]
@@ -0,0 +1,60 @@
+from garden.model import Element, Garden, Rule, Schedule, Sensor, Slave
+
+def test_reading_stays_fresh_until_past_next_due_read():
+    sensor = Sensor({'slave_uuid': 'board', 'driver': 'd', 'measurement_type': 'm', 'pin': 1, 'sample_interval': 600})
+    sensor.recordRead(5.0, 1000.0)
+
+    assert sensor.freshReading(1000.0 + 480, 120) == 5.0
+    assert sensor.freshReading(1000.0 + 720, 120) == 5.0
+    assert sensor.freshReading(1000.0 + 721, 120) is None
+
+def test_slow_sensor_reading_visible_between_reads(app, connections, monkeypatch):
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        sensor = Sensor({'slave_uuid': slave.uuid, 'driver': 'd', 'measurement_type': 'm', 'pin': 1, 'sample_interval': 600})
+        sensor.save()
+
+        garden = Garden()
+        garden.connection_manager = connections
+        connections.values[sensor.uuid] = 5.0
+
+        clock = [1000.0]
+        monkeypatch.setattr('garden.model.time.time', lambda: clock[0])
+
+        garden.readActiveSensors()
+        assert garden.readings[sensor.uuid] == 5.0
+
+        for elapsed in (120, 300, 480, 599):
+            clock[0] = 1000.0 + elapsed
+            garden.readActiveSensors()
+            assert garden.readings[sensor.uuid] == 5.0
+
+        assert len([read for read in connections.reads if read]) == 1
+
+def test_sensors_of_starting_schedule_read_first(app, connections, clock, monkeypatch):
+    monkeypatch.setitem(app.config, 'GARDEN_SENSOR_READS_PER_TICK', 1)
+
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        busy = Sensor({'slave_uuid': slave.uuid, 'driver': 'd', 'measurement_type': 'm', 'pin': 1, 'priority': 5})
+        busy.save()
+        watched = Sensor({'slave_uuid': slave.uuid, 'driver': 'd', 'measurement_type': 'm', 'pin': 2})
+        watched.save()
+
+        schedule = Schedule({'nickname': 'always', 'schedule_start': 0, 'schedule_end': 86399, 'active': 1})
+        schedule.save()
+        rule = Rule({'schedule_uuid': schedule.uuid, 'logic_type': 'and'})
+        rule.save()
+        Element({'rule_uuid': rule.uuid, 'sensor_uuid': watched.uuid, 'max_value': 25, 'target_value': 20, 'min_value': None}).save()
+
+        garden = Garden()
+        garden.connection_manager = connections
+
+        # the schedule starts on this tick, so its sensor beats a higher priority one
+        for stage in garden._stages:
+            if stage in ('checkSchedule', 'readActiveSensors'):
+                getattr(garden, stage)()
+
+        assert connections.reads == [[watched.uuid]]
@@ -0,0 +1,18 @@
+from garden.simulator import Simulation
+
+def test_simulation_survives_replug():
+    simulation = Simulation(boards=2, sensors=2, relays=2, latency=0, jitter=0, unplug_every=2, seed=1)
+
+    # board 1 is unplugged on tick 2 and back on tick 3
+    garden = simulation.run(4)
+
+    assert len(garden.readings) == 4
+    for value in garden.readings.values():
+        assert 15 <= value <= 25
+
+    first, second = simulation.boards
+    assert set(pin for pin, state in first.writes) == set([20, 21])
+
+    # the replugged board gets its relays written again
+    for pin in (20, 21):
+        assert len([write for write in second.writes if write[0] == pin]) >= 2
@@ -0,0 +1,77 @@
+import datetime
+
+from garden.db import get_db
+from garden.model import Consequence, Element, Garden, Relay, Rule, RuleLimit, Schedule, Sensor, Slave
+
+def insert_activation(db, uuid, start, end, last_update, rule_uuid=None, relay_uuid=None):
+    db.execute(
+        'INSERT INTO activation (uuid, rule_uuid, relay_uuid, start_time, end_time, last_update) VALUES (?, ?, ?, ?, ?, ?)',
+        (uuid, rule_uuid, relay_uuid, start, end, last_update))
+
+def test_bulk_load_matches_per_rule_load(app):
+    now = datetime.datetime.now().replace(microsecond=0)
+    ago = lambda seconds: now - datetime.timedelta(seconds=seconds)
+
+    with app.app_context():
+        slave = Slave({'nickname': 'board', 'connected': 1})
+        slave.save()
+        sensor = Sensor({'slave_uuid': slave.uuid, 'driver': 'd', 'measurement_type': 'm', 'pin': 1})
+        sensor.save()
+        relay = Relay({'slave_uuid': slave.uuid, 'relay_type': 'r', 'pin': 2})
+        relay.save()
+        schedule = Schedule({'nickname': 'always', 'schedule_start': 0, 'schedule_end': 86399, 'active': 1})
+        schedule.save()
+
+        rules = {}
+        for name, limits in (('first', 2), ('second', 1), ('third', 0)):
+            rule = Rule({'schedule_uuid': schedule.uuid, 'logic_type': 'and'})
+            rule.save()
+            element = Element({'rule_uuid': rule.uuid, 'sensor_uuid': sensor.uuid, 'max_value': 25, 'target_value': 20, 'min_value': None})
+            element.save()
+            consequence = Consequence({'rule_uuid': rule.uuid, 'relay_uuid': relay.uuid})
+            consequence.save()
+            limit_uuids = set()
+            for index in range(limits):
+                limit = RuleLimit({'rule_uuid': rule.uuid, 'period': 600, 'every': 3600 * (index + 1)})
+                limit.save()
+                limit_uuids.add(limit.uuid)
+            rules[name] = (rule.uuid, element.uuid, consequence.uuid, limit_uuids)
+
+        first, second = rules['first'][0], rules['second'][0]
+        db = get_db()
+        insert_activation(db, 'first-open', ago(300), None, ago(100), rule_uuid=first)
+        insert_activation(db, 'first-recent', ago(2400), ago(1800), ago(1800), rule_uuid=first)
+        insert_activation(db, 'first-old', ago(90000), ago(89000), ago(89000), rule_uuid=first)
+        insert_activation(db, 'second-recent', ago(900), ago(600), ago(600), rule_uuid=second)
+        insert_activation(db, 'relay-open', ago(500), None, ago(50), relay_uuid=relay.uuid)
+        db.commit()
+
+        garden = Garden()
+
+        # only activations left open are closed, at their last update
+        end_times = dict((row['uuid'], row['end_time']) for row in db.execute('SELECT uuid, end_time FROM activation'))
+        assert end_times == {
+            'first-open': ago(100),
+            'first-recent': ago(1800),
+            'first-old': ago(89000),
+            'second-recent': ago(600),
+            'relay-open': ago(50)}
+
+        span = lambda start, end: (ago(start).timestamp(), ago(end).timestamp())
+        windows = {first: [span(2400, 1800), span(300, 100)], second: [span(900, 600)]}
+
+        for name in rules:
+            rule_uuid, element_uuid, consequence_uuid, limit_uuids = rules[name]
+            rule = garden.rules.fetchByUUID(rule_uuid)
+
+            assert set(rule.elements.records) == set([element_uuid])
+            assert set(rule.consequences.records) == set([consequence_uuid])
+            assert set(rule.limits.records) == limit_uuids
+
+            # what the per-rule query loaded: anything open, closed at its last update, or ended in the last 24 hours
+            for limit in rule.limits.iterate():
+                assert list(limit.window.closed) == windows.get(rule_uuid, [])
+                assert limit.window.open_start is None
+
+        window_sizes = dict((limit.rule_uuid, len(limit.window.closed)) for limit in garden.rule_limits.iterate())
+        assert window_sizes == {first: 2, second: 1}
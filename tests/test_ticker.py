@@ -0,0 +1,69 @@
+import pytest
+
+from garden.ticker import TickScheduler
+
+class SteppedClock(object):
+    """Monotonic clock that only moves when the code under test sleeps or a tick runs"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SteppedClock()
+    monkeypatch.setattr('garden.ticker.time', clock)
+    return clock
+
+def run_ticks(ticker, clock, durations):
+    """Run one tick per duration and return when each started, relative to the first"""
+    starts = []
+
+    for duration in durations:
+        ticker.waitForDeadline()
+        starts.append(clock.now)
+        clock.now += duration
+        ticker.completeTick()
+
+    return [pytest.approx(start - starts[0]) for start in starts]
+
+def test_ticks_start_on_the_grid(clock):
+    ticker = TickScheduler(1.0, report_every=0)
+
+    assert run_ticks(ticker, clock, [0.2, 0.5, 0.9, 0.1]) == [0, 1, 2, 3]
+    assert ticker.overruns == 0
+    assert ticker.skipped == 0
+    assert ticker.max_jitter == pytest.approx(0)
+
+def test_single_overrun_starts_next_tick_at_once(clock):
+    ticker = TickScheduler(1.0, report_every=0)
+
+    # the late tick starts straight away, then the loop is back in phase
+    assert run_ticks(ticker, clock, [1.5, 0.2, 0.2]) == [0, 1.5, 2]
+    assert ticker.overruns == 1
+    assert ticker.skipped == 0
+    assert ticker.max_jitter == pytest.approx(0.5)
+
+def test_long_overrun_skips_missed_deadlines(clock):
+    ticker = TickScheduler(1.0, report_every=0)
+
+    # deadlines 1 and 2 are skipped rather than run back to back
+    assert run_ticks(ticker, clock, [3.5, 0.2, 0.2]) == [0, 3.5, 4]
+    assert ticker.overruns == 1
+    assert ticker.skipped == 2
+    assert ticker.max_jitter == pytest.approx(0.5)
+    assert ticker.max_duration == pytest.approx(3.5)
+
+def test_stage_over_budget_counted(clock):
+    ticker = TickScheduler(1.0, budgets={'readActiveSensors': 0.5}, report_every=0)
+
+    ticker.recordStage('readActiveSensors', 0.6)
+    ticker.recordStage('readActiveSensors', 0.4)
+    ticker.recordStage('checkRules', 10)
+
+    assert ticker.stage_overruns == {'readActiveSensors': 1}